@@ -24,9 +24,20 @@ Created on 30.03.2011
     along with this program.  If not, see <http://www.gnu.org/licenses/>
 """
 
+import os
+import array
+import numpy
+try:
+    from sys import intern
+except ImportError:
+    pass # python 2: intern is a builtin
+
 
 # agent allegiance keys:
-SI, SFI, ALL = "SI", "SFI", "ALL"
+SI, SFI, ALL = 0, 1, 2
+
+# names of the allegiance keys (e.g. for storing them in files)
+ALLEGIANCE_NAMES = ("SI", "SFI", "ALL")
 
 #SANCTION = "SI"         # sanction institution
 #SANCTION_FREE = "SFI"   # sanction free institution
@@ -38,14 +49,52 @@ SI, SFI, ALL = "SI", "SFI", "ALL"
 #
 ###############################################################################
 
-def validateSanctions(positive, negative, maxTokens, indices):
+# data type of the sanction arrays (strategies may assign fractions of tokens)
+SANCTION_DTYPE = numpy.float64
+
+
+def emptySanctions(numAgents):
+    """Returns a tuple (positive, negative) of two sanction arrays of length 
+    'numAgents' in which no tokens have been assigned to any agent."""
+    return (numpy.zeros(numAgents, dtype=SANCTION_DTYPE), 
+            numpy.zeros(numAgents, dtype=SANCTION_DTYPE))
+
+
+def indexMask(indices, numAgents):
+    """Returns a boolean array of length 'numAgents' that is True exactly at
+    the given (anonymized) agent indices."""
+    mask = numpy.zeros(numAgents, dtype=bool)
+    mask[list(indices)] = True
+    return mask
+
+
+def validateSanctions(positive, negative, maxTokens, mask):
     """Returns true, if not more than 'maxTokens' have been
-    used for sanctioning and only agents listed in indices have 
-    been sanctioned."""
-    indexError = ( ( set(negative.keys()) \
-                   | set(positive.keys()) ) - set(indices)) != set() 
-    return not indexError and \
-           sum(positive.values()) + sum(negative.values()) <= maxTokens
+    used for sanctioning and only agents for which the boolean array 'mask'
+    is True have been sanctioned with a non-negative number of tokens. 
+    'positive' and 'negative' are arrays of tokens indexed by the 
+    (anonymized) agent index. (Use 'indexMask' to build the mask once from 
+    a list of indices.)"""
+    if positive.shape != mask.shape or negative.shape != mask.shape:
+        return False
+    outside = ~mask
+    if positive[outside].any() or negative[outside].any():
+        return False
+    if (positive < 0).any() or (negative < 0).any():
+        return False
+    return positive.sum() + negative.sum() <= maxTokens
+
+
+def invalidSanctions(positives, negatives, maxTokens, mask):
+    """Returns a boolean array that is True for every row of the sanction
+    matrices 'positives' and 'negatives' (sanctioning agent x anonymized 
+    agent index) that does not pass validateSanctions(). 'mask' is a boolean 
+    matrix of the same shape that marks the agents each row may sanction."""
+    outside = ~mask
+    invalid = ((positives * outside).any(axis=1) | 
+               (negatives * outside).any(axis=1) |
+               (positives < 0).any(axis=1) | (negatives < 0).any(axis=1))
+    return invalid | (positives.sum(axis=1) + negatives.sum(axis=1) > maxTokens)
 
 
 
@@ -69,16 +118,17 @@ class AgentInfo(object):
 
         account         - int: the accumulated results from all the previous 
                           rounds.   
-        allegiance      - string: the institution to which the agent belongs
+        allegiance      - int: the institution to which the agent belongs
+                          (either SI or SFI)
         contribution    - int: amount of tokens that an agent contributed for
                           the provision of the public good in the last round
         profit          - int: the net profit of the agent in the voluntary
                           contribution stage, i.e. sum of tokens kept and
                           the individual benefit from the public good
-        sanctPositive   - dictionary (agentNr, tokens) of positive sanctions
-                          given by the agent
-        sanctNegative   - dictionary (agentNr, tokens) of negative sanctions 
-                          dealt out by the agent
+        sanctPositive   - array of tokens (indexed by agentNr) of positive 
+                          sanctions given by the agent
+        sanctNegative   - array of tokens (indexed by agentNr) of negative 
+                          sanctions dealt out by the agent
         recievedSanct   - int: the value received from positive and negative
                           sanctioning by others (e.g.  received_positive - 3 * 
                           received negative, however, the precise formula depends
@@ -99,6 +149,17 @@ class AgentInfo(object):
         sanctioning     - int: total number of tokens spent for either positive 
                           sanctions or negative sanctions
     """
+
+    __slots__ = ("world", "account", "allegiance", "contribution", "profit", 
+                 "_sanctPositive", "_sanctNegative", "_sanctioning",
+                 "receivedSanct", "commendations", "punishments")
+
+    _VARIABLES = ("account", "allegiance", "commendations", "contribution", 
+                  "profit", "punishments", "receivedSanct", "sanctPositive", 
+                  "sanctNegative")
+    _VARIABLES_SET = frozenset(_VARIABLES)
+    _NUMERIC_VARIABLES = ("account", "commendations", "contribution", 
+                          "profit", "punishments", "receivedSanct")
       
     def __init__(self, source = None, world = None, keys = None):
         """Constructor for AgentInfo. All variables are initialized with 0 or,
@@ -107,21 +168,62 @@ class AgentInfo(object):
         classId is an identifier for the class the agent belongs to. By 
         default, i.e. if 'None' it evaluates to the class name."""
         self.world = world
+        self._sanctioning = None
             
-        if isinstance(source, AgentInfo):
-            for key in self.variables():
-                self.__dict__[key] = source.__dict__[key]
-        elif isinstance(source, dict):
-            self.__dict__.update(source)
-        elif isinstance(source, list) or isinstance(source, tuple):
+        # the order of the checks follows the frequency of the cases 
+        # (lists and tuples are used when loading or rebuilding rounds) 
+        if isinstance(source, (list, tuple)):
             if keys == None:
                 keys = self.variables()
-            self.__dict__.update(dict(zip(keys, source))) 
+            for key, value in zip(keys, source):
+                setattr(self, key, value)
+        elif isinstance(source, AgentInfo):
+            self.account = source.account
+            self.allegiance = source.allegiance
+            self.commendations = source.commendations
+            self.contribution = source.contribution
+            self.profit = source.profit
+            self.punishments = source.punishments
+            self.receivedSanct = source.receivedSanct
+            self._sanctPositive = source._sanctPositive
+            self._sanctNegative = source._sanctNegative
+            self._sanctioning = source._sanctioning
+        elif isinstance(source, dict):
+            for key, value in source.items():
+                setattr(self, key, value)
         else:
+            numAgents = world.numAgents if world != None else 0
             self.account, self.allegiance, self.contribution, self.profit, \
-            self.sanctPositive, self.sanctNegative,\
             self.receivedSanct, self.commendations, self.punishments \
-            = 0, SFI, 0, 0, {}, {}, 0, 0, 0
+            = 0, SFI, 0, 0, 0, 0, 0
+            self.setSanctions(*emptySanctions(numAgents))
+
+    def setSanctions(self, positive, negative):
+        """Sets the arrays of positive and negative sanctions and stores the 
+        total number of tokens spent for sanctioning."""
+        self._sanctPositive = positive
+        self._sanctNegative = negative
+        self._sanctioning = float(positive.sum() + negative.sum())
+
+    @property
+    def sanctPositive(self):
+        """Returns the array of positive sanctions given by the agent."""
+        return self._sanctPositive
+    
+    @sanctPositive.setter
+    def sanctPositive(self, positive):
+        self._sanctPositive = positive
+        self._sanctioning = None
+
+    @property
+    def sanctNegative(self):
+        """Returns the array of negative sanctions dealt out by the agent."""
+        return self._sanctNegative
+    
+    @sanctNegative.setter
+    def sanctNegative(self, negative):
+        self._sanctNegative = negative
+        self._sanctioning = None
 
     @property
     def netProfit(self):
@@ -141,39 +243,171 @@ class AgentInfo(object):
     @property
     def sanctioning(self):
         """Returns the total number of tokens spent for either positive 
-        sanctions or negative sanctions."""
-        return sum(self.sanctPositive.values()) \
-               + sum(self.sanctNegative.values())
+        sanctions or negative sanctions. (The total is computed only once 
+        after the sanctions have been set. Sanction arrays must not be 
+        modified in place.)"""
+        if self._sanctioning == None:
+            self._sanctioning = float(self._sanctPositive.sum() + 
+                                      self._sanctNegative.sum())
+        return self._sanctioning
 
     @classmethod
     def variables(cls):
         """Returns a list of the names of all true variables of an AgentInfo 
         object in alphabetical order. (References (e.g. world) or 
         class variables are not included.)"""
-        return ("account", "allegiance", "commendations", "contribution", 
-                "profit", "punishments", "receivedSanct", "sanctPositive", 
-                "sanctNegative")
+        return cls._VARIABLES
     
     def values(self):
         """Returns the values of all true variables of the AgentInfo object 
         (except the world reference) as list that is ordered according to the
         alphabetical order of the variable names."""
-        return [self.__dict__[v] for v in self.variables()]
+        return [getattr(self, v) for v in AgentInfo._VARIABLES]
         #return [self.allegiance, self.commendations, self.contribution, 
         #        self.profit, self.punishments, self.receivedSanct, 
         #        self.sanctioning]
   
+    def numericValues(self):
+        """Returns the values of the numeric variables (i.e. all variables
+        except allegiance and the sanctions) in alphabetical order of the 
+        variable names as an array of doubles."""
+        return array.array("d", (self.account, self.commendations, 
+                                 self.contribution, self.profit, 
+                                 self.punishments, self.receivedSanct))
+  
     def asDict(self):
         """Returns the relevant agent info (true variables, no references,
         properties or world object) as dictionary."""
         return dict(zip(self.variables(), self.values())) 
 
 
-assert set(AgentInfo().variables()).issubset(set(AgentInfo().__dict__.keys())),\
+class FrozenAgentInfo(AgentInfo):
+    """A snapshot of an agent's state at the end of a round, as stored in
+    the agent's history and the rounds of the chronicles. The variables must
+    not be changed after construction, which allows the values of the 
+    properties netProfit and overallResult to be computed only once.
+    """
+    
+    __slots__ = ("_netProfit", "_overallResult")
+    
+    def __init__(self, source = None, world = None, keys = None):
+        self._netProfit = None
+        self._overallResult = None
+        AgentInfo.__init__(self, source, world, keys)
+        
+    @property
+    def netProfit(self):
+        """Returns the net profit from the voluntary contribution stage plus 
+        (or minus) the received sanctions."""
+        if self._netProfit == None:
+            self._netProfit = self.profit + self.receivedSanct
+        return self._netProfit
+    
+    @property
+    def overallResult(self):
+        """Returns the overall result from the voluntary contribution stage 
+        and the sanctioning stage (see AgentInfo.overallResult)."""
+        if self._overallResult == None:
+            self._overallResult = AgentInfo.overallResult.fget(self)
+        return self._overallResult
+
+
+def _selftest():
+    """Checks that the variable names of AgentInfo match its variables."""
+    assert all(hasattr(AgentInfo(), v) for v in AgentInfo.variables()),\
         "Self-Test failed: Variable names of AgentInfo do not match variables!"
+
+# the self-tests are called by the unit tests; on import they are only run if
+# the environment variable ECOEXLAB_SELFTEST is set
+if __debug__ and os.environ.get("ECOEXLAB_SELFTEST"):
+    _selftest()
     
 
 
+###############################################################################
+#
+#  record arrays of agent infos
+#
+###############################################################################
+
+# record layout of the scalar variables of AgentInfo objects; the field order 
+# follows AgentInfo.variables()
+RECORD_DTYPE = numpy.dtype([("account", numpy.float64),
+                            ("allegiance", numpy.uint8),
+                            ("commendations", numpy.float64),
+                            ("contribution", numpy.float64),
+                            ("profit", numpy.float64),
+                            ("punishments", numpy.float64),
+                            ("receivedSanct", numpy.float64)])
+
+
+def infoRecords(infos):
+    """Returns a tuple (records, positive, negative) for the sequence of 
+    agents or AgentInfo objects 'infos', where 'records' is a record 
+    array of RECORD_DTYPE and 'positive' and 'negative' are (agents x agents)
+    arrays of the sanctions given by each agent."""
+    records = numpy.zeros(len(infos), dtype=RECORD_DTYPE)
+    buffer = array.array("d")
+    for ag in infos:
+        buffer.extend(ag.numericValues())
+    numeric = numpy.frombuffer(buffer, dtype=numpy.float64).reshape(
+                    (len(infos), len(AgentInfo._NUMERIC_VARIABLES)))
+    for k, name in enumerate(AgentInfo._NUMERIC_VARIABLES):
+        records[name] = numeric[:, k]
+    records["allegiance"] = [ag.allegiance for ag in infos]
+    positive = numpy.array([ag.sanctPositive for ag in infos], 
+                           dtype=SANCTION_DTYPE)
+    negative = numpy.array([ag.sanctNegative for ag in infos], 
+                           dtype=SANCTION_DTYPE)
+    return (records, positive, negative)
+
+
+def recordInfos(records, positive, negative, world):
+    """Returns a tuple of FrozenAgentInfo objects connected to 'world' from a 
+    record array and the sanction arrays (see infoRecords())."""
+    keys = RECORD_DTYPE.names + ("sanctPositive", "sanctNegative")
+    infos = []
+    for values, pos, neg in zip(records.tolist(), positive, negative):
+        infos.append(FrozenAgentInfo(values + (pos, neg), world, keys))
+    return tuple(infos)
+
+
+class AgentStates(object):
+    """Column-wise storage of the scalar variables (see RECORD_DTYPE) of 
+    the agents of a world. Each variable is an array indexed by the 
+    position of the agent in the world's agent list, so that institutions 
+    can update the state of all their members at once. Agents read and 
+    write their own entries through properties (see AgentBase).
+    """
+    
+    __slots__ = RECORD_DTYPE.names
+    
+    def __init__(self, numAgents):
+        for name in RECORD_DTYPE.names:
+            setattr(self, name, numpy.zeros(numAgents, 
+                                            dtype=RECORD_DTYPE[name]))
+            
+    def records(self, out = None):
+        """Returns the states as record array of RECORD_DTYPE. If given, the
+        record array 'out' is filled instead of creating a new one."""
+        if out is None:
+            out = numpy.zeros(len(self.account), dtype=RECORD_DTYPE)
+        for name in RECORD_DTYPE.names:
+            out[name] = getattr(self, name)
+        return out
+
+
+def _stateProperty(name, convert):
+    """Returns a property for an AgentBase object that reads and writes the
+    variable 'name' in the agent's entry of its AgentStates object."""
+    def get(self):
+        return convert(getattr(self._states, name)[self.worldIndex])
+    def set(self, value):
+        getattr(self._states, name)[self.worldIndex] = value
+    return property(get, set)
+
+
+
 ###############################################################################
 #
 #  PublicInfo
@@ -185,7 +419,8 @@ class PublicInfo(object):
     """Contains a snapshot of the publicly available anonymized information 
     about a single agent. 
     
-        allegiance      - string: the institution to which the agent belongs
+        allegiance      - int: the institution to which the agent belongs
+                          (either SI or SFI)
         contribution    - int: amount of tokens that an agent contributed for
                           the provision of the public good in the last round
         profit          - int: the net profit of the agent in the voluntary
@@ -210,21 +445,23 @@ class PublicInfo(object):
                           sanctions or negative sanctions
     """
     
+    __slots__ = ("allegiance", "commendations", "contribution", "netProfit",
+                 "overallResult", "profit", "punishments", "receivedSanct",
+                 "sanctioning")
+    
     def __init__(self, source):
         """Initializes the object with the data from either an agent or an, 
         AgentInfo or PublicInfo object."""
-        if isinstance(source, PublicInfo):
-            for key in self.variables():
-                self.__dict__[key] = source.__dict__[key]            
-        else: # assume instance of AgentInfo
-            assert isinstance(source, AgentInfo)
-            sourceVariables = set(source.variables())
-            for key in self.variables():
-                if key in sourceVariables:
-                    self.__dict__[key] = source.__dict__[key]
-            self.netProfit = source.netProfit
-            self.overallResult = source.overallResult
-            self.sacntioning = source.sanctioning
+        assert isinstance(source, PublicInfo) or isinstance(source, AgentInfo)
+        self.allegiance = source.allegiance
+        self.commendations = source.commendations
+        self.contribution = source.contribution
+        self.profit = source.profit
+        self.punishments = source.punishments
+        self.receivedSanct = source.receivedSanct
+        self.netProfit = source.netProfit
+        self.overallResult = source.overallResult
+        self.sanctioning = source.sanctioning
             
     def variables(self):
         """Returns a list of the names of all variables of an PublicInfo 
@@ -237,7 +474,35 @@ class PublicInfo(object):
         """Returns the values of all variables of the PublicInfo object 
         as list that is ordered according to the alphabetical order of the 
         variable names."""
-        return [self.__dict__[v] for v in self.variables()]
+        return [getattr(self, v) for v in self.variables()]
+
+
+def publicInfos(world, order):
+    """Returns a tuple of PublicInfo snapshots of the agents of 'world' in 
+    the sequence given by the list 'order' of their positions in the 
+    world's agent list. The variables are read from the world's AgentStates
+    object column by column instead of agent by agent."""
+    states = world.states
+    columns = [getattr(states, name)[order].tolist() for name in 
+               ("allegiance", "commendations", "contribution", "profit", 
+                "punishments", "receivedSanct")]
+    columns.append([world.agents[i].sanctioning for i in order])
+    infos = []
+    for allegiance, commendations, contribution, profit, punishments, \
+            receivedSanct, sanctioning in zip(*columns):
+        # bypass __init__, which copies the variables from a source object
+        info = PublicInfo.__new__(PublicInfo)
+        info.allegiance = allegiance
+        info.commendations = commendations
+        info.contribution = contribution
+        info.profit = profit
+        info.punishments = punishments
+        info.receivedSanct = receivedSanct
+        info.netProfit = profit + receivedSanct
+        info.overallResult = info.netProfit + world.sanctionTokens - sanctioning
+        info.sanctioning = sanctioning
+        infos.append(info)
+    return tuple(infos)
 
 
 
@@ -260,8 +525,13 @@ class AgentBase(AgentInfo):
         classId - string: an identifier for the class the agent belongs
                   to. (By default set to self.__class__.__name__) May be 
                   overwritten in order to group agents
-        history - list of AgentInfo object: records the agent's state during
+        history - list of FrozenAgentInfo objects: records the agent's state during
                   all previous rounds of the experiment.
+        lastInfo - FrozenAgentInfo object or None: the last entry of the 
+                   history (None before the first round is completed)
+        worldIndex - int: the position of the agent in the world's agent list
+                     (the scalar variables are stored in the world's 
+                     AgentStates object at this index, see attachStates())
                      
         All Variables will be initialized with zero, except self.world (None)
         and self.allegiance (randomly either SI or SFI).
@@ -269,30 +539,57 @@ class AgentBase(AgentInfo):
         To implement an agent, derive from this class and implement methods:
         chooseInstitution(), contribute() and sanction().
     """
+    __slots__ = ("classId", "agentId", "history", "lastInfo", "worldIndex", 
+                 "_states")
+    
     agent_counter = 1
     
+    account = _stateProperty("account", float)
+    allegiance = _stateProperty("allegiance", int)
+    commendations = _stateProperty("commendations", float)
+    contribution = _stateProperty("contribution", float)
+    profit = _stateProperty("profit", float)
+    punishments = _stateProperty("punishments", float)
+    receivedSanct = _stateProperty("receivedSanct", float)
+    
     def __str__(self):
         return self.agentId
     
     def __init__(self):
+        # until the agent is attached to a world it keeps its own states
+        self._states = AgentStates(1)
+        self.worldIndex = 0
         AgentInfo.__init__(self)
-        self.classId = self.__class__.__name__        
-        self.agentId = "%4i" % AgentBase.agent_counter+"."+self.__class__.__name__
+        self.classId = intern(self.__class__.__name__)
+        self.agentId = "%4i.%s" % (AgentBase.agent_counter, self.classId)
         AgentBase.agent_counter += 1
         self.history = []
+        self.lastInfo = None
+        
+    def attachStates(self, states, index):
+        """Moves the agent's scalar variables to the entry 'index' of the
+        AgentStates object 'states'."""
+        for name in RECORD_DTYPE.names:
+            getattr(states, name)[index] = getattr(self._states, name)[
+                                                            self.worldIndex]
+        self._states = states
+        self.worldIndex = index
                 
     def connect(self, worldInfo):
-        """Connects the agent to the world."""
+        """Connects the agent to the world. (The sanction arrays are 
+        resized to the number of agents in the world.)"""
         self.world = worldInfo
+        self.setSanctions(*emptySanctions(worldInfo.numAgents))
       
     def roundComplete(self):
         """Notifies the agent that the current round is finished."""
-        self.history.append(AgentInfo(self))
+        self.lastInfo = FrozenAgentInfo(self)
+        self.history.append(self.lastInfo)
         
     # Abstract methods that must be overridden by the contrete Agent classes
 
     def chooseInstitution(self):
-        """Returns eihter 'SI' or 'SFI' depending on whether the player choses
+        """Returns eihter SI or SFI depending on whether the player choses
         the sanctioning (SI) or the sanction free (SFI) institution for the 
         next round.""" 
         raise NotImplementedError    
@@ -305,10 +602,10 @@ class AgentBase(AgentInfo):
         
     def sanction(self, tokens, otherAgentIndices):
         """Returns the sanction that an agent exerts with max 'tokens'.
-        Return value must be a tuple of two dictionaries (positive, negative).
-        that contain the (anonymized) indices of the other 
-        agents within the same institution as keys and the tokens spent for
-        sanctioning as values.
+        Return value must be a tuple of two arrays (positive, negative) 
+        of length world.numAgents (see emptySanctions()) that contain the 
+        tokens spent for sanctioning at the (anonymized) indices of the other
+        agents within the same institution and zero everywhere else.
         """
         raise NotImplementedError
         
@@ -0,0 +1,77 @@
+"""Batch - Functions for running a number of independent replicas of a
+simulation, e.g. for Monte Carlo studies or parameter sweeps.
+
+Created on 14.10.2026
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>
+"""
+
+import random
+import multiprocessing
+import numpy
+
+from World import World
+from Chronicles import Chronicles
+
+
+def _runReplica(args):
+    """Runs replica number 'nr' of the simulation defined by 'setup' and
+    returns the chronicles as JSON string (which, unlike the chronicles
+    object, can be passed between processes)."""
+    setup, nr, seed = args
+    if seed != None:
+        random.seed(seed + nr)
+        numpy.random.seed(seed + nr)
+    chronicles = Chronicles("Replica %i" % nr)
+    world = World(chronicles)
+    world.setup(*setup(nr))
+    world.run()
+    return chronicles.toJSON()
+
+
+def runReplicas(setup, replicas, processes = None, seed = None):
+    """Runs 'replicas' independent replicas of a simulation and returns the
+    list of their chronicles objects.
+
+    'setup' is a function that takes the number of the replica and
+    returns the arguments for World.setup(), i.e. a tuple (agents, game,
+    maxRounds, contribTokens, sanctionTokens). Because the replicas are
+    run in separate processes, 'setup' must be a function that is defined
+    at module level.
+
+    'processes' is the number of worker processes (by default the number
+    of CPUs). If 'processes' is 1, the replicas are run one after the
+    other in the current process.
+
+    If 'seed' is given, the random number generators of replica 'nr' are
+    seeded with 'seed' + 'nr', so that the results are reproducible.
+    """
+    assert replicas >= 1, "need at least one replica!"
+    tasks = [(setup, nr, seed) for nr in range(replicas)]
+    if processes == 1:
+        results = [_runReplica(task) for task in tasks]
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(_runReplica, tasks)
+        finally:
+            pool.close()
+            pool.join()
+
+    chroniclesList = []
+    for s in results:
+        chronicles = Chronicles()
+        chronicles.fromJSON(s)
+        chroniclesList.append(chronicles)
+    return chroniclesList
@@ -21,8 +21,14 @@ Created on 04.04.2011
 
 
 import time, json
+import numpy
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-from Agent import AgentInfo
+from Agent import AgentInfo, SANCTION_DTYPE, RECORD_DTYPE, ALLEGIANCE_NAMES, \
+        recordInfos
 from World import World
 from Statistics import ExperimentStatistics
 
@@ -39,7 +45,7 @@ class ChroniclesInterface(object):
         """Notifies the chronicles of the completion of the round."""
         raise NotImplementedError
     
-    def evaluation(self):
+    def evaluation(self, cachePath = None):
         """Evaluates the simulation or experimental data."""
         raise NotImplementedError
     
@@ -66,12 +72,28 @@ class Chronicles(ChroniclesInterface):
     """The standard chronicles object: Follows the simulation's or experiment's
     progress in the world object. Allows saving and(!) loading of the collected
     data in a simple JSON format. Produces a simulation statistics.
+    
+    The agent data of all rounds is stored column-wise in numpy arrays. 
+    AgentInfo objects are only created on demand (see roundInfos()).
+    
+    Variables (read only):
+        data            - record array (rounds x agents) of RECORD_DTYPE: 
+                          the scalar agent variables of each round
+        sanctPositive   - array (rounds x agents x agents): the positive 
+                          sanctions given by each agent in each round
+        sanctNegative   - array (rounds x agents x agents): the negative
+                          sanctions given by each agent in each round
+        recordedRounds  - int: the number of rounds recorded so far
     """
 
     def __init__(self, title = "?", experimenters = "N.N.", description = "-"):
         ChroniclesInterface.__init__(self)
         self.world = None        
-        self.rounds = []
+        self.recordedRounds = 0
+        self.data = numpy.zeros((0, 0), dtype=RECORD_DTYPE)
+        self.sanctPositive = numpy.zeros((0, 0, 0), dtype=SANCTION_DTYPE)
+        self.sanctNegative = numpy.zeros((0, 0, 0), dtype=SANCTION_DTYPE)
+        self._roundInfos = []
         self.statistics = None
         self.setupInfo = { TITLE : title,
                            EXPERIMENTERS : experimenters,
@@ -80,21 +102,50 @@ class Chronicles(ChroniclesInterface):
     def connect(self, world):
         self.world = world
         
+    def _allocate(self, maxRounds, numAgents):
+        """Allocates the arrays for storing the data of 'maxRounds' rounds 
+        with 'numAgents' agents."""
+        self.recordedRounds = 0
+        self.data = numpy.zeros((maxRounds, numAgents), dtype=RECORD_DTYPE)
+        self.sanctPositive = numpy.zeros((maxRounds, numAgents, numAgents), 
+                                         dtype=SANCTION_DTYPE)
+        self.sanctNegative = numpy.zeros((maxRounds, numAgents, numAgents),
+                                         dtype=SANCTION_DTYPE)
+        self._roundInfos = [None] * maxRounds
+        
+    def roundInfos(self, roundNr):
+        """Returns a tuple of AgentInfo objects with the data of the agents
+        in round 'roundNr'. (The tuple is created only once per round.)"""
+        assert roundNr < self.recordedRounds, "round not yet recorded"
+        infos = self._roundInfos[roundNr]
+        if infos == None:
+            infos = recordInfos(self.data[roundNr], self.sanctPositive[roundNr],
+                                self.sanctNegative[roundNr], self.world)
+            self._roundInfos[roundNr] = infos
+        return infos
+    
+    @property
+    def rounds(self):
+        """The list of recorded rounds, each a tuple of AgentInfo objects.
+        (Created on demand; prefer the arrays for evaluating the data.)"""
+        return [self.roundInfos(r) for r in range(self.recordedRounds)]
+        
     def setupComplete(self, world):
         assert self.world == None, "setup already reported"
         assert world.roundNr < 0, "simulation is already running"
         
         self.world = world
+        self._allocate(self.world.maxRounds, len(self.world.agents))
+        agentIds = [ag.agentId for ag in self.world.agents]
+        classIds = [ag.classId for ag in self.world.agents]
         self.statistics = ExperimentStatistics(self.world.contribTokens, 
                                                self.world.sanctionTokens, 
-                                               [ag.agentId for ag in world.agents],
-                                               [ag.classId for ag in world.agents])
+                                               agentIds, classIds, self.world)
         
         self.setupInfo[DATE] = time.strftime("%Y-%m-%d %H:%M")
         
-        self.setupInfo["Agents"] = [ag.agentId for ag in self.world.agents]
-        self.setupInfo["Agent classes"] = [ag.classId \
-                                           for ag in self.world.agents]
+        self.setupInfo["Agents"] = agentIds
+        self.setupInfo["Agent classes"] = classIds
         self.setupInfo["Game"] = str(self.world.game)
         self.setupInfo["Institutions"] = [str(self.world.SI), str(self.world.SFI)]
         self.setupInfo["Number of Rounds"] = self.world.maxRounds
@@ -107,11 +158,15 @@ class Chronicles(ChroniclesInterface):
         assert self.world, "missing world object"
         assert self.setupInfo != {}, "setupComplete() must be called first"
         assert self.world.roundNr >= 0, "simulation has not even started"
+        assert self.world.roundNr == self.recordedRounds, "round missed"
 
-        # gather a non-anonymized list of AgentInfo objects
-        infoList = tuple(AgentInfo(agent) for agent in self.world.agents)
-        self.rounds.append(infoList)        
-        self.statistics.add(infoList, self.world.roundNr)
+        r = self.world.roundNr
+        self.world.states.records(self.data[r])
+        self.sanctPositive[r] = [ag.sanctPositive for ag in self.world.agents]
+        self.sanctNegative[r] = [ag.sanctNegative for ag in self.world.agents]
+        self.recordedRounds += 1
+        self.statistics.addRecords(self.data[r], self.sanctPositive[r], 
+                                   self.sanctNegative[r], r)
         
     def stats(self):
         """Returns the ExperimentStatistics object."""
@@ -123,29 +178,89 @@ class Chronicles(ChroniclesInterface):
         assert self.setupInfo != {}, "setupComplete() hasn't been called"
         return self.setupInfo
         
-    def evaluation(self):
+    def evaluation(self, cachePath = None):
         """Evaluates the simulation's or experiment's data and returns a
-        report. 
+        report. If 'cachePath' is given, the results are cached in this
+        file (see ExperimentStatistics.evaluation()).
         """
-        assert len(self.rounds) == self.world.maxRounds, \
+        assert self.recordedRounds == self.world.maxRounds, \
                 "simulation is still running"
-        return self.statistics.evaluation()
+        return self.statistics.evaluation(cachePath)
         
     
+    def _jsonChunks(self):
+        """Yields the JSON representation of the data stored in the 
+        chronicles object piece by piece (one piece per round), so that it
+        can be written without building the whole string at once."""
+        assert self.recordedRounds > 0, "no simulation has been recorded"
+        def dumps(obj, indent):
+            """Returns 'obj' as JSON string with sorted keys and an 
+            indentation of two spaces, indented as a whole by 'indent'."""
+            if orjson != None:
+                s = orjson.dumps(obj, option = orjson.OPT_SORT_KEYS | 
+                                 orjson.OPT_INDENT_2).decode("utf-8")
+            else:
+                s = json.dumps(obj, sort_keys=True, indent=2)
+            return s.replace("\n", "\n" + indent)
+        
+        def sanctionDicts(sanctions):
+            """Returns the rows of the sanction matrix 'sanctions' as
+            dictionaries agentNr -> tokens of the sanctioned agents (the 
+            file format stores only the tokens actually given)."""
+            dicts = [{} for row in sanctions]
+            rows, columns = numpy.nonzero(sanctions)
+            for i, k, v in zip(rows.tolist(), columns.tolist(), 
+                               sanctions[rows, columns].tolist()):
+                dicts[i][str(k)] = v
+            return dicts
+        
+        n = self.recordedRounds
+        # the values of a record are in the order of the record fields,
+        # which is the order of the variables in the file format
+        allegiance = self.data.dtype.names.index("allegiance")
+        separator = '{\n  "Results": [\n    '
+        for rd, pos, neg in zip(self.data[:n].tolist(), 
+                                self.sanctPositive[:n], self.sanctNegative[:n]):
+            infos = []
+            for values, p, q in zip(rd, sanctionDicts(pos), 
+                                    sanctionDicts(neg)):
+                values = list(values)
+                values[allegiance] = ALLEGIANCE_NAMES[values[allegiance]]
+                infos.append(values + [p, q])
+            yield separator + dumps(infos, "    ")
+            separator = ",\n    "
+        yield '\n  ],\n  "Setup": ' + dumps(self.setupInfo, "  ") + "\n}"
+    
     def toJSON(self):
         """Converts the data stored in the chronicles object to a JSON string.
         """
-        assert len(self.rounds) > 0, "no simulation has been recorded"
-        r = [[ag.values() for ag in rd] for rd in self.rounds]
-        d = {"Setup": self.setupInfo, "Results": r}
-        return json.dumps(d, sort_keys=True, indent=2)
+        return "".join(self._jsonChunks())
+    
+    def writeJSON(self, f):
+        """Writes the JSON string of the data stored in the chronicles object
+        (see toJSON()) round by round to the file (opened in text mode) 'f'.
+        """
+        for chunk in self._jsonChunks():
+            f.write(chunk)
 
 
     def fromJSON(self, s):
         """Initializes the chronicles object with the data from a JSON string.
+        's' can also be the undecoded (UTF-8) bytes read from a JSON file.
         """
         assert len(self.setupInfo) <= 5, "chronicles object already in use"
         
+        def sanctionArray(sanctions, numAgents):
+            """Converts the stored sanctions (dictionaries agentNr -> tokens
+            or, in files written by intermediate versions, lists of tokens) 
+            into a sanction array."""
+            if isinstance(sanctions, dict):
+                a = numpy.zeros(numAgents, dtype=SANCTION_DTYPE)
+                for k, v in sanctions.items():
+                    a[int(k)] = v
+                return a
+            return numpy.array(sanctions, dtype=SANCTION_DTYPE)
+        
         def buildMockWorld(setupInfo, results):
             assert len(results) > 0, "no results stored in JSON file !?"
             mockWorld = World(self)
@@ -156,7 +271,7 @@ class Chronicles(ChroniclesInterface):
             mockWorld.numAgents = len(results[0])
             return mockWorld            
                
-        d = json.loads(s)                
+        d = orjson.loads(s) if orjson != None else json.loads(s)
         self.setupInfo = d["Setup"]
         variables = self.setupInfo["Basic Variables"]
         assert set(variables) == set(AgentInfo.variables()), \
@@ -164,11 +279,35 @@ class Chronicles(ChroniclesInterface):
                 "Uncomment this line at your own risk!"        
         results = d["Results"]
         self.world = buildMockWorld(self.setupInfo, results)
-        self.rounds = [[AgentInfo(values, self.world, variables) \
-                        for values in rd] for rd in results]
+        numAgents = self.world.numAgents
+        self._allocate(len(results), numAgents)
+        
+        # columns[r][k] is the tuple of values of variable k in round r
+        columns = [tuple(zip(*rd)) for rd in results]
+        def column(name):
+            k = variables.index(name)
+            return [c[k] for c in columns]
+        
+        for name in RECORD_DTYPE.names:
+            if name == "allegiance":
+                codes = dict((a, i) for i, a in enumerate(ALLEGIANCE_NAMES))
+                self.data[name] = [[codes[a] for a in c] 
+                                   for c in column(name)]
+            else:
+                self.data[name] = column(name)
+        for name, target in (("sanctPositive", self.sanctPositive),
+                             ("sanctNegative", self.sanctNegative)):
+            values = column(name)
+            if isinstance(values[0][0], dict):
+                values = [[sanctionArray(s, numAgents) for s in c] 
+                          for c in values]
+            target[:] = numpy.asarray(values, dtype=SANCTION_DTYPE)
+        self.recordedRounds = len(results)
         self.statistics = ExperimentStatistics(self.setupInfo["Tokens for Contribution"],
                                                self.setupInfo["Tokens for Sanctioning"],
                                                self.setupInfo["Agents"],
-                                               self.setupInfo["Agent classes"])
-        for i, infoList in enumerate(self.rounds):
-            self.statistics.add(infoList, i)
+                                               self.setupInfo["Agent classes"],
+                                               self.world)
+        for i in range(self.recordedRounds):
+            self.statistics.addRecords(self.data[i], self.sanctPositive[i], 
+                                       self.sanctNegative[i], i)
@@ -23,6 +23,32 @@ Created on 31.03.2011
     along with this program.  If not, see <http://www.gnu.org/licenses/>
 """
 
+import os
+import numpy
+try:
+    from numba import njit
+except ImportError:
+    def njit(*args, **kwargs):
+        """Stand-in for numba's njit decorator if numba is not installed:
+        returns the decorated function unchanged."""
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda func: func
+
+
+@njit(cache=True, fastmath=True)
+def _linearPerCapitaReturn(contributions, mcpr):
+    """Returns the per capita return mcpr * S for the array of 
+    'contributions' (S being the total of the contributions)."""
+    S = 0.0
+    for i in range(contributions.shape[0]):
+        S += contributions[i]
+    return mcpr * S
+
+# compile (or load from cache) once at import time rather than in the first
+# round of a simulation
+_linearPerCapitaReturn(numpy.zeros(1), 0.5)
+
 
 class PublicGoodsGameBase(object):
     """Abstract base class for public good games. Implementing classes
@@ -33,10 +59,17 @@ class PublicGoodsGameBase(object):
        
     def __str__(self):
         return self.__class__.__name__
+    
+    def bind(self, numAgents):
+        """Called by the world during setup with the number of agents in the
+        world, i.e. the largest number of agents that can participate in
+        one game. Can be overridden to precompute values that only depend
+        on the number of participants."""
+        pass
        
     def _selftest(self):
         assert self._validate(self._mcpr(0.5, 1000), 1000), \
-                + "Marginal per capita return value of " \
+                "Marginal per capita return value of " \
                 + "is out of the definitional bounds of a public " \
                 + "goods game; must be smaller than 1 and greater than 1/n!"       
        
@@ -83,8 +116,37 @@ class PublicGoodsGame(PublicGoodsGameBase):
         PublicGoodsGameBase.__init__(self)
         self.gain = gain_factor
         self.minN = int(gain_factor)+1
-        self._selftest()
+        self._mcprTable = ()
+        # the self-test is called by the unit tests; here it is only run if 
+        # the environment variable ECOEXLAB_SELFTEST is set
+        if __debug__ and os.environ.get("ECOEXLAB_SELFTEST"):
+            self._selftest()
+        
+    def bind(self, numAgents):
+        """Precomputes the marginal per capita returns gain/n for up to 
+        'numAgents' participants."""
+        self._mcprTable = (0.0,) + tuple(self.gain / n 
+                                         for n in range(1, numAgents + 1))
     
     def _mcpr(self, r, n):        
         return self.gain / n
 
+    def perCapitaReturn(self, contributions, maxContrib):
+        """Returns the per capita return for the list of individual 
+        'contributions'. (Same as PublicGoodsGameBase.perCapitaReturn, but 
+        uses a compiled kernel, because the marginal per capita return 
+        does not depend on the contribution ratio in this game. Subclasses
+        that override _mcpr() are served by the base class' method.)"""
+        if type(self)._mcpr != PublicGoodsGame._mcpr:
+            return PublicGoodsGameBase.perCapitaReturn(self, contributions, 
+                                                       maxContrib)
+        n = len(contributions)
+        assert n >= 1, "Bowling alone? "
+        if n < len(self._mcprTable):
+            mcpr = self._mcprTable[n]
+        else:
+            mcpr = self.gain / n
+        return _linearPerCapitaReturn(numpy.asarray(contributions, 
+                                                    dtype=numpy.float64), 
+                                      mcpr)
+
@@ -19,7 +19,48 @@ Created on 05.04.2011
     along with this program.  If not, see <http://www.gnu.org/licenses/>
 """
 
-from Agent import validateSanctions
+import numpy
+try:
+    import numba
+except ImportError:
+    numba = None
+
+from Agent import invalidSanctions, emptySanctions, indexMask, SANCTION_DTYPE
+from Game import njit
+
+
+@njit(cache=True)
+def _applySanctions(tokens, values, impacts, counts, received):
+    """Adds the sanction 'tokens' (matrix: sanctioning agent x anonymized 
+    index of the sanctioned agent) to the 'counts' of the sanctioned agents 
+    and the corresponding 'impacts' (array: impact of each of the sorted 
+    token 'values') to the values 'received'."""
+    rows, columns = numpy.nonzero(tokens)
+    for i in range(rows.shape[0]):
+        k = columns[i]
+        v = tokens[rows[i], k]
+        counts[k] += v
+        received[k] += impacts[numpy.searchsorted(values, v)]
+
+def _accumulateSanctions(tokens, values, impacts, counts, received):
+    """Array version of _applySanctions() for the case that numba is not 
+    available. The rows of the sanction matrix are added one after the 
+    other, i.e. in the same order as by _applySanctions(), so that both 
+    yield exactly the same sums (adding the zeros is exact)."""
+    for row in tokens:
+        counts += row
+        received += numpy.where(row != 0, 
+                                impacts[numpy.searchsorted(values, row)], 0)
+
+if numba == None:
+    _applySanctions = _accumulateSanctions
+
+# compile (or load from cache) once at import time
+_applySanctions(numpy.zeros((1, 1), dtype=SANCTION_DTYPE), 
+                numpy.zeros(1, dtype=SANCTION_DTYPE), 
+                numpy.zeros(1, dtype=numpy.float64), 
+                numpy.zeros(1, dtype=numpy.float64), 
+                numpy.zeros(1, dtype=numpy.float64))
 
 
 class Institution(object):
@@ -40,6 +81,20 @@ class Institution(object):
         
     def connect(self, worldInfo):
         self.world = worldInfo
+        
+    def _map(self, func, items):
+        """Returns the list of the results of 'func' for all 'items'. The
+        calls are run on the world's thread pool, if it has one."""
+        if self.world.executor != None:
+            return list(self.world.executor.map(func, items))
+        else:
+            return [func(item) for item in items]
+        
+    def memberIndices(self):
+        """Returns an array of the positions of the members in the world's
+        agent list (and thus in the world's AgentStates object)."""
+        return numpy.array([agent.worldIndex for agent in self.members], 
+                           dtype=int)
     
     def contributionStage(self):
         """Asks the members for contributions. Records the
@@ -48,19 +103,24 @@ class Institution(object):
         assert self.world, "Institution not connected to a world!"
         if len(self.members) == 0: return
         
-        contribsList = []
-        for agent in self.members:
-            contrib = agent.contribute(self.world.contribTokens)
-            if contrib < 0 or contrib > self.world.contribTokens:
-                raise ValueError(contrib, str(agent))
-            agent.contribution = contrib
-            contribsList.append(contrib)
+        tokens = self.world.contribTokens
+        contribs = numpy.fromiter(self._map(lambda agent: 
+                                            agent.contribute(tokens), 
+                                            self.members), 
+                                  dtype=numpy.float64, count=len(self.members))
+        invalid = (contribs < 0) | (contribs > tokens)
+        if invalid.any():
+            k = int(numpy.argmax(invalid))
+            raise ValueError(contribs[k], str(self.members[k]))
             
-        pcr = self.world.game.perCapitaReturn(contribsList, 
-                                              self.world.contribTokens)
-        for agent in self.members:
-            agent.profit = pcr + self.world.contribTokens - agent.contribution
-            agent.account += agent.profit
+        # one array operation: profit = (per capita return + tokens) - contrib
+        pcr = self.world.game.perCapitaReturn(contribs, tokens)
+        profits = numpy.subtract(pcr + tokens, contribs)
+        indices = self.memberIndices()
+        states = self.world.states
+        states.contribution[indices] = contribs
+        states.profit[indices] = profits
+        states.account[indices] += profits
 
     def sanctioningStage(self):
         """Abstract method for the sanctioning stage of the experiment/
@@ -79,12 +139,13 @@ class SanctionFreeInstitution(Institution):
         assert self.world, "Institution not connected to a world!"
         
         for agent in self.members:
-            agent.sanctPositive = {}
-            agent.sanctNegative = {}
-            agent.receivedSanct = 0
-            agent.commendations = 0
-            agent.punishments = 0         
-            agent.account += self.world.sanctionTokens
+            agent.setSanctions(*emptySanctions(self.world.numAgents))
+        indices = self.memberIndices()
+        states = self.world.states
+        states.receivedSanct[indices] = 0
+        states.commendations[indices] = 0
+        states.punishments[indices] = 0
+        states.account[indices] += self.world.sanctionTokens
         
         
 
@@ -111,44 +172,70 @@ class SanctioningInstitution(SanctionFreeInstitution):
             super(SanctioningInstitution, self).sanctioningStage()
             return
                         
-        # mapping from anonymized agent index to agent object
-        anonymizedMembersDict = dict([(self.world.anonymizedIndex(ag), ag) \
-                                      for ag in self.members])
-        indexMap = dict([(self.world.anonymizedIndex(ag), i) \
-                         for i,ag in enumerate(self.world.agents)])
+        # anonymized index of each agent in the world's agent list
+        globalMap = self.world.anonymizedMap
+        indices = self.memberIndices()
+        anonymized = globalMap[indices]
+        anonymizedIndices = anonymized.tolist()
+        # members that may be sanctioned by each member in this round
+        membersMask = numpy.tile(indexMask(anonymizedIndices, 
+                                           self.world.numAgents),
+                                 (len(self.members), 1))
+        membersMask[numpy.arange(len(self.members)), anonymized] = False
         
-        for agent in self.members:
-            agent.receivedSanct = 0
-            agent.commendations = 0
-            agent.punishments = 0
-            agent.account += self.world.sanctionTokens
+        states = self.world.states
+        states.account[indices] += self.world.sanctionTokens
         
-        for agent in self.members:
-            otherAgentIndices = list(anonymizedMembersDict.keys())
-            otherAgentIndices.remove(self.world.anonymizedIndex(agent))
+        # received tokens and impacts by anonymized agent index
+        punishments = numpy.zeros(self.world.numAgents, dtype=numpy.float64)
+        commendations = numpy.zeros(self.world.numAgents, dtype=numpy.float64)
+        received = numpy.zeros(self.world.numAgents, dtype=numpy.float64)
+        # the strategies of the agents are python code, therefore only 
+        # the sanctions are collected here and applied afterwards
+        others = [anonymizedIndices[:i] + anonymizedIndices[i+1:] 
+                  for i in range(len(self.members))]
+        sanctions = self._map(lambda i: self.members[i].sanction(
+                                        self.world.sanctionTokens, others[i]),
+                              range(len(self.members)))
+        shape = (self.world.numAgents,)
+        for i, (positive, negative) in enumerate(sanctions):
+            if positive.shape != shape or negative.shape != shape:
+                raise ValueError(positive, negative, others[i])
+        # sanctions of all members (member x anonymized agent index)
+        positives = numpy.array([s[0] for s in sanctions], dtype=SANCTION_DTYPE)
+        negatives = numpy.array([s[1] for s in sanctions], dtype=SANCTION_DTYPE)
+        invalid = invalidSanctions(positives, negatives, 
+                                   self.world.sanctionTokens, membersMask)
+        if invalid.any():
+            i = int(numpy.argmax(invalid))
+            positive, negative = sanctions[i]
+            raise ValueError(positive, negative, others[i], 
+                             positive.sum() + negative.sum())
             
-            positive, negative = agent.sanction(self.world.sanctionTokens, 
-                                                otherAgentIndices)
-            if not validateSanctions(positive, negative, 
-                                self.world.sanctionTokens, otherAgentIndices): 
-                raise ValueError(positive, negative, otherAgentIndices, 
-                               sum(positive.values()) + sum(negative.values()))    
-            agent.account += self.world.sanctionTokens - agent.sanctioning
-            agent.sanctPositive = dict([(indexMap[i], v) \
-                                        for i,v in positive.items()])
-            agent.sanctNegative = dict([(indexMap[i], v) \
-                                        for i,v in negative.items()])           
-
-            for k,v in negative.items():
-                ag = anonymizedMembersDict[k]          
-                ag.punishments += v
-                impact = self.punishment(v)
-                ag.receivedSanct += impact
-                ag.account += impact 
-                
-            for k,v in positive.items():
-                ag = anonymizedMembersDict[k]
-                ag.commendations += v
-                impact = self.commendation(v)
-                ag.receivedSanct += impact
-                ag.account += impact
+        # impact of each number of tokens that has been used (the strategies
+        # may use fractions of tokens)
+        values = numpy.unique(numpy.concatenate((positives, negatives), 
+                                                axis=None))
+        punishmentImpacts = numpy.array([self.punishment(v) 
+                                         for v in values.tolist()], 
+                                        dtype=numpy.float64)
+        commendationImpacts = numpy.array([self.commendation(v) 
+                                           for v in values.tolist()], 
+                                          dtype=numpy.float64)
+        _applySanctions(negatives, values, punishmentImpacts, punishments, 
+                        received)
+        _applySanctions(positives, values, commendationImpacts, commendations, 
+                        received)
+        
+        # the members pay for the sanctions of the previous round
+        spent = numpy.array([agent.sanctioning for agent in self.members])
+        positives = positives[:, globalMap]
+        negatives = negatives[:, globalMap]
+        for agent, positive, negative in zip(self.members, positives, negatives):
+            agent.setSanctions(positive, negative)
+        
+        states.account[indices] += self.world.sanctionTokens - spent
+        states.punishments[indices] = punishments[anonymized]
+        states.commendations[indices] = commendations[anonymized]
+        states.receivedSanct[indices] = received[anonymized]
+        states.account[indices] += received[anonymized]
@@ -20,10 +20,79 @@ Created on 10.04.2011
     along with this program.  If not, see <http://www.gnu.org/licenses/>
 """
 
-import os
-import matplotlib, numpy
-matplotlib.use("Agg")
-from matplotlib import pyplot
+import os, threading
+import numpy
+
+# matplotlib is only imported when the first plot is started, so that
+# simulations that do not plot anything do not pay for loading it
+matplotlib = None
+Figure = None
+FigureCanvasAgg = None
+_loadLock = threading.Lock()
+
+def _loadMatplotlib():
+    """Imports matplotlib (with the Agg backend), if this has not been done
+    yet."""
+    if matplotlib != None: return
+    with _loadLock:
+        if matplotlib == None: _importMatplotlib()
+        
+def _importMatplotlib():
+    global matplotlib, Figure, FigureCanvasAgg
+    import matplotlib as mpl
+    mpl.use("Agg")
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib import font_manager
+    # look up the default font once rather than in the first plot
+    font_manager.findfont(font_manager.FontProperties())
+    matplotlib = mpl
+
+# figures of finished plots, ready to be reused by the next plot
+_figurePool = []
+
+
+# caches for labels that are the same in many plots
+_linebreaksCache = {}
+_condensedTicksCache = {}
+
+def addLinebreaks(label, lineWidth):
+    """Returns 'label' with line breaks inserted between words, so that the
+    lines do not exceed 'lineWidth' characters (unless a single word is 
+    longer). Results are cached."""
+    key = (label, lineWidth)
+    if key in _linebreaksCache:
+        return _linebreaksCache[key]
+    sl = label.split(" ")
+    dl = [sl[0]]
+    chCnt = len(sl[0])
+    for s in sl[1:]:
+        chCnt += len(s)
+        if chCnt > lineWidth and chCnt - len(s) > 3:
+            dl.append("\n")
+            chCnt = len(s)
+        else:
+            dl.append(" ")
+        dl.append(s)
+    result = "".join(dl)
+    _linebreaksCache[key] = result
+    return result
+
+def condensedTicks(xvalues, condenseFactor):
+    """Returns a tuple (majorTicks, minorTicks, labels) of the tick positions
+    and tick labels for 'xvalues' data points that are condensed by 
+    'condenseFactor'. Results are cached; the arrays are read-only."""
+    key = (xvalues, condenseFactor)
+    if key not in _condensedTicksCache:
+        ticks = numpy.arange(1, xvalues // condenseFactor + 1, dtype=float)
+        majorTicks, minorTicks = ticks - 0.5, ticks - 1
+        majorTicks.setflags(write=False)
+        minorTicks.setflags(write=False)
+        starts = numpy.arange(1, xvalues+1, 5)
+        labels = tuple(numpy.char.add(numpy.char.mod("%d-", starts), 
+                            numpy.char.mod("%d", starts+condenseFactor-1)))
+        _condensedTicksCache[key] = (majorTicks, minorTicks, labels)
+    return _condensedTicksCache[key]
 
 
 class Plotter(object):
@@ -37,6 +106,8 @@ class Plotter(object):
         'filepath' is the pathe where the plotted image will be stored.
         'filetypes' is a tuple of filetype extensions. For each of the
         listed filetypes an image file with the plot will be stored.
+        'filepath' can also be a file-like object to which the image is
+        written in the format of the first of the 'filetypes'.
         
         If 'condense_factor' is greater 1 than 'condense_factor' number of 
         data points will be averaged into one data point. Keep in mind: 
@@ -73,6 +144,8 @@ class Plotter(object):
         
         self.plots = []
         self.plotNames = []
+        
+        self._buffers = {}  # cached arrays of x-positions and bar bottoms
 
         self.xvalues = 0       # number of x values, set when the first data is plotet and should always be the same
         self.condense_factor = condense_factor  # number of data points on the x-axis that shall be condensed into 1 point
@@ -105,24 +178,35 @@ class Plotter(object):
         that in each row a package of 'steps' numers is reduced to one number
         representing the average value of the package.
         """
-        if data.flatten()[0] == None: return data
         assert data.ndim in [1,2], "data must be one or two-dimensional"
         assert data.shape[data.ndim-1] % steps == 0, \
                 "steps %i not a divisor of array length %i" % \
                 (steps, data.shape[data.ndim-1])
         
-        def condense(a, steps):
-            """condense a one dimensional array"""
-            b = a.reshape((a.shape[0]/steps, steps))
-            return numpy.array([p[numpy.where(~numpy.isnan(p))].mean() \
-                                for p in b])
-        
-        if data.ndim == 2:
-            return numpy.array([condense(row, steps) for row in data])
-        else: 
-            return condense(data, steps)
+        shape = data.shape[:-1] + (data.shape[-1] // steps, steps)
+        return numpy.nanmean(data.reshape(shape), axis=-1)
         
          
+    def _positions(self, n, offset):
+        """Returns the (cached, read-only) array of 'n' x-positions
+        0+offset, 1+offset, ..., n-1+offset."""
+        key = ("positions", n, offset)
+        if key not in self._buffers:
+            positions = numpy.arange(n, dtype=float) + offset
+            positions.setflags(write=False)
+            self._buffers[key] = positions
+        return self._buffers[key]
+    
+    def _zeros(self, n):
+        """Returns a (cached) array of 'n' zeros. The array is reset to zero 
+        on every call, so its content is only valid until the next call."""
+        key = ("zeros", n)
+        if key not in self._buffers:
+            self._buffers[key] = numpy.zeros(n, dtype=float)
+        else:
+            self._buffers[key].fill(0.0)
+        return self._buffers[key]
+         
     def beginPlot(self, xlabel, ylabel, xlim, ylim):
         """Starts a new plot. 'filepath' is a filename (including the
         path) to which the image will be written when calling 'endPlot'. 
@@ -135,13 +219,20 @@ class Plotter(object):
         """
         assert self.figure == None, \
                 "Need to finish the last plot with endPlot() first!"
+        _loadMatplotlib()
 
         self.xlabel, self.left_ylabel = xlabel, ylabel
         self.right_ylabel = ""
         self.xlim, self.left_ylim = xlim, ylim
         self.right_ylim = None
 
-        self.figure = pyplot.figure()
+        try: # (pop() is atomic, so plots can be made in several threads)
+            self.figure = _figurePool.pop()
+            self.figure.clf()
+            self.figure.set_size_inches(matplotlib.rcParams["figure.figsize"])
+        except IndexError:
+            self.figure = Figure()
+            FigureCanvasAgg(self.figure)
         
         if self.layout_hstretch != 1.0:
             self.figure.set_figwidth(self.layout_hstretch \
@@ -172,22 +263,9 @@ class Plotter(object):
         
         
     def endPlot(self):
-        """Finishes a plot and saves the image(s) of the plot to the disk.
+        """Finishes a plot and saves the image(s) of the plot to the disk. (The
+        figure is kept for reuse by the next plot.)
         """
-        def add_linebreaks(label, lineWidth):
-            sl = label.split(" ")
-            dl = [sl[0]]
-            chCnt = len(sl[0])
-            for s in sl[1:]:
-                chCnt += len(s)
-                if chCnt > lineWidth and chCnt - len(s) > 3:
-                    dl.append("\n")
-                    chCnt = len(s)
-                else:
-                    dl.append(" ")
-                dl.append(s)
-            return "".join(dl)
-                        
         assert self.figure, "Plotting must be started with beginPlot() first!"
         
         if self.left_ylim: self.left_axis.set_ylim(self.left_ylim)
@@ -202,19 +280,17 @@ class Plotter(object):
             ticks = list(self.left_axis.get_xticks()[1:])
             if ticks[0] >= 5: ticks.insert(0, 1.0)
             ticks = numpy.array(ticks)
-            labels = tuple([str(int(t)) for t in ticks])
+            labels = tuple(numpy.char.mod("%d", ticks))
+            majorTicks = ticks - 0.5
         else:
             if self.xlim: 
                 self.left_axis.set_xlim(self.xlim[0]/self.condense_factor,
                                         self.xlim[1]/self.condense_factor)          
-            nticks = self.xvalues / self.condense_factor
-            ticks = numpy.arange(1, nticks+1, dtype = float)
-            labels = tuple([str(i)+"-"+str(i+self.condense_factor-1) \
-                            for i in range(1, self.xvalues+1, 5)])
-            minorTicks = ticks - 1
+            majorTicks, minorTicks, labels = condensedTicks(self.xvalues, 
+                                                        self.condense_factor)
             self.left_axis.set_xticks(minorTicks, minor=True)
             
-        self.left_axis.set_xticks(ticks - 0.5)
+        self.left_axis.set_xticks(majorTicks)
         try:
             self.left_axis.xaxis.set_tick_params(which="major", length=0)
         except AttributeError: # old version of matplotlib
@@ -224,8 +300,8 @@ class Plotter(object):
         self.left_axis.set_xticklabels(labels)
         
         for i in range(len(self.plotNames)):
-            self.plotNames[i] = add_linebreaks(self.plotNames[i], 
-                                               self.layout_legend_linebreak)
+            self.plotNames[i] = addLinebreaks(self.plotNames[i], 
+                                              self.layout_legend_linebreak)
         
         l = self.left_axis.legend(self.plots, self.plotNames,
                                   bbox_to_anchor = self.layout_legend_anchor, 
@@ -235,12 +311,19 @@ class Plotter(object):
                                   loc = self.layout_legend_location)
         l.draw_frame(False)            
         
-        filepath, ext = os.path.splitext(self.filepath)
-        extensions = list(self.filetypes)
-        if ext and ext not in extensions:
-            extensions.append(ext)        
-        for ext in extensions:
-            self.figure.savefig(filepath+ext)   
+        if hasattr(self.filepath, "write"):
+            self.figure.savefig(self.filepath, 
+                                format = self.filetypes[0].lstrip("."))
+        else:
+            filepath, ext = os.path.splitext(self.filepath)
+            extensions = list(self.filetypes)
+            if ext and ext not in extensions:
+                extensions.append(ext)        
+            for ext in extensions:
+                self.figure.savefig(filepath+ext)   
+        
+        _figurePool.append(self.figure)
+        self.figure = None
 
 
     def _selectAxis(self, yaxis):
@@ -259,24 +342,25 @@ class Plotter(object):
         """Returns a tuple (data, errorBars) where 'data' and 'errorBars' are
         always two dimensional numpy array, no matter whether 'data' was a 
         list or an array of one or two dimentsions and 'errorBars' was None, 
-        or a (nested) list or array of one or two dimensions."""
+        or a (nested) list or array of one or two dimensions. If 'errorBars' 
+        was None, the returned errorBars are a read-only array of NaNs."""
         if not isinstance(data, numpy.ndarray): 
             data = numpy.array(data)
-        if errorBars != None and not isinstance(errorBars, numpy.ndarray): 
+        if errorBars is not None and not isinstance(errorBars, numpy.ndarray): 
             errorBars = numpy.array(errorBars)
         if data.ndim == 1: 
             data = data.reshape((1, data.shape[0]))
-            if errorBars != None:
+            if errorBars is not None:
                 errorBars = errorBars.reshape((1, data.shape[1]))
-        if errorBars == None: 
-            errorBars = numpy.array([[None]*data.shape[1]])
+        if errorBars is None: 
+            errorBars = numpy.broadcast_to(numpy.nan, data.shape)
         return (data, errorBars)
 
     def linePlot(self, names, data, errorBars = None, yaxis = "left"):
         """Plots one or several graphs. 'names' is list of names of the graphs,
         'data' is a one or two dimensional array that contains the data.
         """
-        withoutErrorBars = errorBars == None
+        withoutErrorBars = errorBars is None
         data, errorBars = self._normDataFormat(data, errorBars)
         assert withoutErrorBars or data.shape == errorBars.shape, \
             "Mismatch between data shape %s and error bars shape %s" \
@@ -289,37 +373,37 @@ class Plotter(object):
         self.xvalues = data.shape[1]
         if self.condense_factor > 1: 
             data = self._condensed(data, self.condense_factor)
-            errorBars = self._condensed(errorBars, self.condense_factor)
+            if not withoutErrorBars:
+                errorBars = self._condensed(errorBars, self.condense_factor)
 
         ax, ylim = self._selectAxis(yaxis)
-        xvals = numpy.arange(len(data[0]), dtype=float)+0.5
+        xvals = self._positions(len(data[0]), 0.5)
         
         for i in range(len(names)):
             style = self.lineStyles[(i+self.lineIndex) % len(self.lineStyles)]
             
             if ylim and False: # could be confusing, therefore turned off
-                indices = numpy.where(numpy.isnan(data[i]) | \
-                                      (data[i] < ylim[0]) | \
-                                      (data[i] > ylim[1]))[0]
+                valid = ~(numpy.isnan(data[i]) | (data[i] < ylim[0]) | \
+                          (data[i] > ylim[1]))
             else:
-                indices = numpy.where(numpy.isnan(data[i]))[0]
-                                  
-            indices = numpy.concatenate((indices, numpy.array([len(data[i])])))
-            start = 0; pl = []
-            for idx in indices:
-                if idx - start > 0:
-                    if withoutErrorBars:
-                        pl = ax.plot(xvals[start:idx], data[i][start:idx], 
-                                     marker = style[0], linestyle = style[1], 
-                                     color = style[2], 
-                                     markerfacecolor = style[3])
-                    else:
-                        pl = ax.errorbar(xvals[start:idx], data[i][start:idx], 
-                                     marker = style[0], linestyle = style[1], 
-                                     color = style[2], 
-                                     markerfacecolor = style[3],
-                                     yerr = errorBars[i][start:idx])
-                start = idx+1
+                valid = ~numpy.isnan(data[i])
+            
+            # start and end indices of the runs of valid data points
+            edges = numpy.flatnonzero(numpy.diff(numpy.concatenate(
+                                      ([False], valid, [False])).view(numpy.int8)))
+            pl = []
+            for start, end in zip(edges[0::2], edges[1::2]):
+                if withoutErrorBars:
+                    pl = ax.plot(xvals[start:end], data[i][start:end], 
+                                 marker = style[0], linestyle = style[1], 
+                                 color = style[2], 
+                                 markerfacecolor = style[3])
+                else:
+                    pl = ax.errorbar(xvals[start:end], data[i][start:end], 
+                                 marker = style[0], linestyle = style[1], 
+                                 color = style[2], 
+                                 markerfacecolor = style[3],
+                                 yerr = errorBars[i][start:end])
                 
             if len(pl) > 0: 
                 self.plots.append(pl[0])
@@ -335,7 +419,7 @@ class Plotter(object):
         stacked upon each other. (In order not to stack the graphs of 
         several bar graphs, barPlot() must be called several times.)
         """
-        withoutErrorBars = errorBars == None        
+        withoutErrorBars = errorBars is None
         data, errorBars = self._normDataFormat(data, errorBars)
         assert withoutErrorBars or data.shape == errorBars.shape, \
             "Mismatch between data shape %s and error bars shape %s" \
@@ -348,22 +432,25 @@ class Plotter(object):
         self.xvalues = data.shape[1]
         if self.condense_factor > 1: 
             data = self._condensed(data, self.condense_factor)
-            errorBars = self._condensed(errorBars, self.condense_factor)            
+            if not withoutErrorBars:
+                errorBars = self._condensed(errorBars, self.condense_factor)            
             barw = 0.5
         else:
             barw = 1
         offset = (1-barw)/2
 
-        data[numpy.where(numpy.isnan(data))] = 0.0
+        data[numpy.isnan(data)] = 0.0
+        # the bars of each row are stacked upon the sum of the previous rows
+        bottoms = numpy.cumsum(data[:len(names)-1], axis=0)
 
         ax = self._selectAxis(yaxis)[0]
         for i in range(len(names)):
             if i == 0:
-                bottom = numpy.zeros(len(data[i]), dtype = numpy.float)
+                bottom = self._zeros(len(data[i]))
             else:
-                bottom += data[i-1]
+                bottom = bottoms[i-1]
             color = self.barColors[(i+self.barIndex) % len(self.barColors)] 
-            pl = ax.bar(numpy.arange(len(data[i]))+offset, data[i], width=barw, 
+            pl = ax.bar(self._positions(len(data[i]), offset), data[i], width=barw, 
                         bottom = bottom, facecolor = color)
             self.plots.append(pl[0])
             self.plotNames.append(names[i])
@@ -371,7 +458,9 @@ class Plotter(object):
 
 
 
-def selftest():
+def selftest(seed = None):
+    rng = numpy.random.RandomState(seed)
+    
     def PC(data):
         "Converts ratio values (0-1) into percentage values (0-100)."
         return numpy.array(data)*100.0   
@@ -412,13 +501,10 @@ def selftest():
     plotter.linePlot([AV_CONTRIB_SFI], PC([results[AV_CONTRIB_SFI]]), yaxis = "right")
     plotter.endPlot()
     
-    def rnd(a,b):
-        return numpy.random.random()*(b-a)+a
-    
-    punish_hc = [rnd(0.3, 0.5) for i in range(30)]
-    no_punish_hc = [rnd(0.3, 0.5) for i in range(30)]
-    payoff_p_hc = [numpy.random.randint(40, 50) for i in range(30)]
-    payoff_nop_hc = [numpy.random.randint(45, 60) for i in range(30)]
+    punish_hc = rng.uniform(0.3, 0.5, 30)
+    no_punish_hc = rng.uniform(0.3, 0.5, 30)
+    payoff_p_hc = rng.randint(40, 50, 30)
+    payoff_nop_hc = rng.randint(45, 60, 30)
     results[PUNISH_HC] = punish_hc
     results[NO_PUNISH_HC] = no_punish_hc
     results[PAYOFF_P_HC] = payoff_p_hc
@@ -434,8 +520,8 @@ def selftest():
     plotter.barPlot([PUNISH_HC, NO_PUNISH_HC], data, yaxis = "left")               
     plotter.linePlot([PAYOFF_P_HC], [results[PAYOFF_P_HC]], yaxis = "right")
     plotter.linePlot([PAYOFF_NOP_HC], [results[PAYOFF_NOP_HC]],
-                     errorBars = [[r/25.0 * numpy.random.random() \
-                                   for r in results[PAYOFF_NOP_HC]]], 
+                     errorBars = [results[PAYOFF_NOP_HC] / 25.0 * 
+                                  rng.random_sample(30)], 
                      yaxis = "right")
     plotter.endPlot()    
     
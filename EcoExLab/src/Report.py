@@ -18,8 +18,12 @@ Created on 10.04.2011
     along with this program.  If not, see <http://www.gnu.org/licenses/>
 """
 
-import os, webbrowser
+import os, io, base64, multiprocessing, threading
 import numpy
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    ThreadPoolExecutor = None
 from Statistics import SI_MEMBERS, SFI_MEMBERS, AV_CONTRIB_SI, AV_CONTRIB_SFI, \
         HIGH_CONTRIBUTORS, FREE_RIDERS, PAYOFF_HC, PAYOFF_FR, NO_PUNISH_HC, \
         PUNISH_HC, PAYOFF_NOP_HC, PAYOFF_P_HC, AGENT_STATS, AGENT_CLASS_STATS, \
@@ -31,6 +35,24 @@ from Plotting import Plotter
 
 
 
+# html templates for the table of contents and the sections
+_MENU_ITEM = '<li><a href="#anchor_%i">%s</a></li>'
+_SECTION_HEADING = '<h2 id="anchor_%i">%s</h2>'
+_TOP_LINK = '<div  style="text-align:right" ><a href="#menu">top^</a></div>'
+
+
+def _interleave(fragments, separator):
+    """Yields the strings from 'fragments' with 'separator' in between (the
+    same as separator.join(fragments), but without building the string)."""
+    first = True
+    for fragment in fragments:
+        if not first:
+            yield separator
+        first = False
+        yield fragment
+
+
+
 class ReportPage(object):
     """Class that helps generating an html report. Takes care of creating
     a table of contents and the like. Currently supports two levels of 
@@ -51,13 +73,13 @@ class ReportPage(object):
     def section(self, name):
         """Adds a new section to the page.
         """
-        anc = "anchor_"+str(self.anchor)
+        n = self.anchor
         self.anchor += 1
         if self.inSubSection:
             self.menu.append('</ol>')
             self.inSubSection = False
-        self.menu.append('<li><a href="#'+anc+'">'+name+'</a></li>')
-        self.sections.append(['<h2 id="'+anc+'">'+name+'</h2>'])
+        self.menu.append(_MENU_ITEM % (n, name))
+        self.sections.append([_SECTION_HEADING % (n, name)])
         
     def subsection(self, name):
         """Adds a new subsection to the page.
@@ -65,46 +87,85 @@ class ReportPage(object):
         if not self.inSubSection:
             self.menu.append('<ol>')
             self.inSubSection = True        
-        anc = "anchor_"+str(self.anchor)
+        n = self.anchor
         self.anchor += 1
-        self.menu.append('<li><a href="#'+anc+'">'+name+'</a></li>')
-        self.sections.append(['<h2 id="'+anc+'">'+name+'</h2>'])        
+        self.menu.append(_MENU_ITEM % (n, name))
+        self.sections.append([_SECTION_HEADING % (n, name)])
         
         
     def add(self, html):
         """Adds some html code to the main part of the page (under the current
         section)."""
         self.sections[-1].append(html)
+        
+    def placeholder(self):
+        """Reserves a place for html code in the current section that is 
+        only available later. Returns the position to be passed to fill()."""
+        self.sections[-1].append("")
+        return (len(self.sections)-1, len(self.sections[-1])-1)
+    
+    def fill(self, position, html):
+        """Puts the html code at the 'position' returned by placeholder()."""
+        section, i = position
+        self.sections[section][i] = html
+                
+    def fragments(self):
+        """Yields the html code of the page piece by piece."""
+        yield '<html>\n<body>\n'
+        
+        for fragment in _interleave(self.top, '\n'):
+            yield fragment
+        
+        yield '<hr  id="menu" />\n'
+        yield '<ol>'
+        for fragment in _interleave(self.menu, '\n'):
+            yield fragment
+        if self.inSubSection:
+            yield '</ol>'
+        yield '</ol>'
+        yield '<hr />\n<br />\n'
+
+        for section in self.sections:
+            for fragment in section:
+                yield fragment
+                yield '\n'
+            yield _TOP_LINK
+        
+        yield '</body>\n</html>\n'
                 
     def writeToDisk(self, path):
-        """Writes the html page to the file 'path'."""
-        with open(path, "w") as f:
-            f.write('<html>\n<body>\n')
-            
-            f.write('\n'.join(self.top))
-            
-            f.write('<hr  id="menu" />\n')
-            f.write('<ol>')
-            f.write('\n'.join(self.menu))
-            if self.inSubSection:
-                f.write('</ol>')
-            f.write('</ol>')              
-            f.write('<hr />\n<br />\n')                    
+        """Writes the html page to the file 'path'. The fragments are 
+        streamed to the file, the page is never built as a whole string."""
+        with open(path, "w", 65536) as f:
+            f.writelines(self.fragments())
+
 
-            for section in self.sections:
-                section.append('<div  style="text-align:right" ><a href="#menu">top^</a></div>')
-                f.write('\n'.join(section))
-            
-            f.write('</body>\n</html>\n')
 
+def PC(data, out = None):
+    """Converts ratio values (0-1) into percentage values (0-100). 'data' 
+    can be a (nested) list or an array. If 'out' is given, the result is 
+    stored in this array, otherwise a new array is returned."""
+    if out is None:
+        out = numpy.array(data, dtype=float) # the only copy of the data
+        out *= 100.0
+        return out
+    return numpy.multiply(data, 100.0, out = out)
 
 
-def PC(data):
-    "Converts ratio values (0-1) into percentage values (0-100)."
-    if isinstance(data, numpy.ndarray):
-        return data*100.0
-    else:
-        return numpy.array(data)*100.0   
+
+# Report object of a plotting worker process (see Report.renderPlots())
+_workerReport = None
+
+def _initPlotWorker(imageFileTypes, maxRounds):
+    global _workerReport
+    _workerReport = Report(None)
+    _workerReport.image_file_types = imageFileTypes
+    _workerReport._maxRounds = maxRounds
+    
+def _renderPlot(job):
+    """Renders the plot 'job' with the worker's report object (see 
+    Report.renderPlot())."""
+    return _workerReport.renderPlot(*job)
 
 
 
@@ -112,27 +173,141 @@ class Report(object):
     """Generates human readable reports from experiment statistics.
     """
     
-    def __init__(self, chronicles):
+    def __init__(self, chronicles, image_file_types = (".png",), 
+                 embed_images = False, source = None, force = False):
         """Initializes a new Report object with an ExperimentStatistics
-        object."""
+        object. 'image_file_types' are the file types in which the plots 
+        are stored. Add ".eps" (or ".pdf", ".svg") for print quality 
+        images, but keep in mind that every additional vector format 
+        roughly doubles the time needed for rendering the plots.
+        If 'embed_images' is True, the html report is a single file with
+        the plots embedded as PNG images instead of a page plus a directory
+        of image files.
+        'source' is the path of the JSON file from which the chronicles 
+        were loaded. If it is given, htmlReport() does not render again the
+        image files that are newer than this file, unless 'force' is True.
+        """
         self.chronicles = chronicles
-        self.image_file_types = [".png", ".eps"] #, ".pdf", ".svg"]
+        self.image_file_types = list(image_file_types)
+        self.embed_images = embed_images
+        if source != None and not force:
+            self._sourceTime = os.path.getmtime(source)
+        else:
+            self._sourceTime = None
+        self._local = threading.local() # scratch arrays for the bar plots
+        self._maxRounds = None
+        
+    @property
+    def maxRounds(self):
+        """The number of rounds of the reported experiment."""
+        if self._maxRounds != None:
+            return self._maxRounds
+        return self.chronicles.world.maxRounds
+        
+    def _plotter(self, imageFilePath, condense_factor = 0):
+        """Returns a Plotter object for the image file(s) 'imageFilePath' 
+        or, if 'imageFilePath' is a file-like object, for a PNG image."""
+        if hasattr(imageFilePath, "write"):
+            fileTypes = (".png",)
+        else:
+            fileTypes = self.image_file_types
+        return Plotter(imageFilePath, fileTypes, "right", 
+                       condense_factor = condense_factor)
+        
+    def _needsRendering(self, imageFilePath):
+        """Returns False, if the image files of the plot 'imageFilePath' all
+        exist and are newer than the source of the chronicles."""
+        if self._sourceTime == None:
+            return True
+        base = os.path.splitext(imageFilePath)[0]
+        for ext in self.image_file_types:
+            fileName = base + ext
+            if not os.path.exists(fileName) or \
+                    os.path.getmtime(fileName) <= self._sourceTime:
+                return True
+        return False
+        
+    def renderPlot(self, method, args):
+        """Calls the plot method named 'method' with the arguments 'args'.
+        If the image file path (the second argument) is None, the plot is 
+        rendered into memory and the PNG image is returned as bytes."""
+        if args[1] is not None:
+            getattr(self, method)(*args)
+            return None
+        sink = io.BytesIO()
+        getattr(self, method)(args[0], sink, *args[2:])
+        return sink.getvalue()
+        
+    def renderPlots(self, jobs, processes = 1, threads = 1):
+        """Renders the plots described by 'jobs', a list of tuples 
+        (name of the plot method, tuple of arguments), and returns the list 
+        of the results of renderPlot(). By default the plots are rendered 
+        in the current process, on a pool of 'threads' threads if 'threads' 
+        is greater than 1. (Threads avoid the start up cost of the processes 
+        and overlap the writing of the image files with the rendering, but
+        the rendering itself mostly holds the GIL.) As the plots are 
+        independent of each other, they can also be rendered in 'processes' 
+        worker processes (None for the number of CPUs). This only pays off 
+        for reports with many plots, as every worker process has to start 
+        up and the arguments of the jobs are pickled."""
+        if processes == None:
+            processes = multiprocessing.cpu_count()
+        if len(jobs) < 2:
+            processes = threads = 1
+        if processes == 1 and threads > 1:
+            assert ThreadPoolExecutor != None, \
+                    "concurrent.futures is needed for rendering in threads"
+            executor = ThreadPoolExecutor(threads)
+            try:
+                return list(executor.map(lambda job: self.renderPlot(*job), 
+                                         jobs))
+            finally:
+                executor.shutdown()
+        if processes == 1:
+            return [self.renderPlot(method, args) for method, args in jobs]
+        pool = multiprocessing.Pool(min(processes, len(jobs)), 
+                                    _initPlotWorker, 
+                                    (self.image_file_types, self.maxRounds))
+        try:
+            return pool.map(_renderPlot, jobs)
+        finally:
+            pool.close()
+            pool.join()
+        
+    def _percentages(self, rows):
+        """Returns the ratio values of the equally long 'rows' as a matrix of
+        percentage values. The matrix is a scratch array that is reused by 
+        the next call, so it must only be passed to Plotter.barPlot(), which 
+        does not keep a reference to it. (Each thread has its own scratch 
+        arrays.)"""
+        buffers = getattr(self._local, "buffers", None)
+        if buffers == None:
+            buffers = self._local.buffers = {}
+        shape = (len(rows), len(rows[0]))
+        if shape not in buffers:
+            buffers[shape] = numpy.empty(shape)
+        buffer = buffers[shape]
+        for i, row in enumerate(rows):
+            PC(row, buffer[i])
+        return buffer
         
     def plot_choice_contrib(self, results, imageFilePath):
         """Plots a graph that depcits the institution choice and the
         contributions of the players/agents from 'results' to one
         or more image files, taking 'imageFilePath' as base name.
         """
-        plotter = Plotter(imageFilePath, self.image_file_types, "right")
+        plotter = self._plotter(imageFilePath)
         plotter.beginDoublePlot("Period",
                 "Percentage in total subject population", 
                 "Contribution in percent of endowment", 
-                (0, self.chronicles.world.maxRounds), 
+                (0, self.maxRounds), 
                 (0,100), (0,100))    
-        data = PC([results[SI_MEMBERS], results[SFI_MEMBERS]])
-        plotter.barPlot([SI_MEMBERS, SFI_MEMBERS], data, yaxis = "left")               
-        plotter.linePlot([AV_CONTRIB_SI], PC([results[AV_CONTRIB_SI]]), yaxis = "right")
-        plotter.linePlot([AV_CONTRIB_SFI], PC([results[AV_CONTRIB_SFI]]), yaxis = "right")
+        data = self._percentages([results[SI_MEMBERS], results[SFI_MEMBERS]])
+        plotter.barPlot([SI_MEMBERS, SFI_MEMBERS], data, yaxis = "left")
+        plotter.linePlot([AV_CONTRIB_SI], PC(results[AV_CONTRIB_SI]), 
+                         yaxis = "right")
+        plotter.linePlot([AV_CONTRIB_SFI], PC(results[AV_CONTRIB_SFI]), 
+                         yaxis = "right")
         plotter.endPlot()
         
     def plot_behavior_payoff(self, results, imageFilePath):
@@ -140,14 +315,16 @@ class Report(object):
         payoff of the players/agents from 'results' to one
         or more image files, taking 'imageFilePath' as base name.
         """        
-        plotter = Plotter(imageFilePath, self.image_file_types, "right")
+        plotter = self._plotter(imageFilePath)
         plotter.beginDoublePlot("Period", 
                 "Percentage in total subject population", 
                 "Payoffs in MUs", 
-                (0, self.chronicles.world.maxRounds), 
+                (0, self.maxRounds), 
                 (0,100), (30,60))    
-        data = PC([results[FREE_RIDERS], results[HIGH_CONTRIBUTORS]])
-        plotter.barPlot([FREE_RIDERS, HIGH_CONTRIBUTORS], data, yaxis = "left")               
+        data = self._percentages([results[FREE_RIDERS], 
+                                  results[HIGH_CONTRIBUTORS]])
+        plotter.barPlot([FREE_RIDERS, HIGH_CONTRIBUTORS], data, 
+                        yaxis = "left")
         plotter.linePlot([PAYOFF_HC], [results[PAYOFF_HC]], yaxis = "right")
         plotter.linePlot([PAYOFF_FR], [results[PAYOFF_FR]], yaxis = "right")
         plotter.endPlot()
@@ -157,29 +334,29 @@ class Report(object):
         and non-punishers from the 'results' to one or more image files
         at 'imageFilePath'.
         """    
-        plotter = Plotter(imageFilePath, self.image_file_types, "right",
-                          condense_factor = 5)
+        plotter = self._plotter(imageFilePath, condense_factor = 5)
         plotter.beginDoublePlot("Periods", 
                 "Percentage of high contributers in SI", 
                 "Payoffs in MUs", 
-                (0, self.chronicles.world.maxRounds), 
+                (0, self.maxRounds), 
                 (0,100), (30,60))
-        data = PC([results[PUNISH_HC], results[NO_PUNISH_HC]])
+        data = self._percentages([results[PUNISH_HC], results[NO_PUNISH_HC]])
         plotter.barPlot([PUNISH_HC, NO_PUNISH_HC], data, yaxis = "left")        
-        plotter.linePlot([PAYOFF_NOP_HC], [results[PAYOFF_NOP_HC]], yaxis = "right")            
+        plotter.linePlot([PAYOFF_NOP_HC], [results[PAYOFF_NOP_HC]], 
+                         yaxis = "right")
         plotter.linePlot([PAYOFF_P_HC], [results[PAYOFF_P_HC]], yaxis = "right")
         plotter.endPlot()
         
     def plot_agent_payoff(self, stats, imageFilePath, deviation = None):
         """Plots the agent statistics for either a single agent or for a group
         of agents."""
-        plotter = Plotter(imageFilePath, self.image_file_types, "right")        
+        plotter = self._plotter(imageFilePath)
         plotter.beginDoublePlot("Period", 
                 "Percentage total agent class", 
                 "Payoffs in MUs", 
-                (0, self.chronicles.world.maxRounds), 
+                (0, self.maxRounds), 
                 (0,100), None)
-        data = PC([stats[AG_SI], stats[AG_SFI]])
+        data = self._percentages([stats[AG_SI], stats[AG_SFI]])
         plotter.barPlot([AG_SI, AG_SFI], data, yaxis = "left")
         if deviation: 
             error = deviation[AG_PAYOFF]
@@ -191,23 +368,18 @@ class Report(object):
     def plot_agent_contrib(self, stats, imageFilePath, deviation = None):
         """Plots the contributions, sanctions and received punishements
         or commendations of an agent."""
-        plotter = Plotter(imageFilePath, self.image_file_types, "right")
+        plotter = self._plotter(imageFilePath)
         plotter.beginDoublePlot("Period",
                 "Coercions received", 
                 "Contribs/Sanctions in percent of endowment", 
-                (0, self.chronicles.world.maxRounds), 
+                (0, self.maxRounds), 
                 None, (0,100))
-        if deviation:
-            error = [deviation[AG_PUNISH], deviation[AG_COMMEND]]
-        else:
-            error = None   
         plotter.barPlot([AG_PUNISH, AG_COMMEND],
                         [stats[AG_PUNISH], stats[AG_COMMEND]],
-                        errorBars = None, yaxis = "left") # graph gets too confusiung if errorBars are plotted here
-        if deviation:
-            error = PC([deviation[AG_CONTRIB], deviation[AG_SANCT]])
-        else:
-            error = None
+                        # graph gets too confusiung if errorBars are plotted
+                        errorBars = None, yaxis = "left")
+        error = PC([deviation[AG_CONTRIB], deviation[AG_SANCT]]) \
+                if deviation else None
         plotter.linePlot([AG_CONTRIB, AG_SANCT], 
                          PC([stats[AG_CONTRIB], stats[AG_SANCT]]), 
                          errorBars = error, yaxis = "right")
@@ -217,7 +389,7 @@ class Report(object):
     def infoParagraph(self, keyword, info):
         """Returns the entry associated with 'keyword' from the info 
         dictionary as HTML code formatted as a single paragraph."""
-        if keyword in info.keys():
+        if keyword in info:
             return('<p><i>'+keyword+'</i> : ' + info[keyword] + '</p>\n')
         else:
             return ''
@@ -226,11 +398,10 @@ class Report(object):
         """Returns the entries from dictionary 'info' listed in 'keywordList' 
         as HTML Table."""
         table = ['<table border="0" cellspacing="10" summary="parameters">']
-        valid_keys = info.keys()
         for kw in keywordList:
-            if kw in valid_keys:
+            if kw in info:
                 entry = info[kw]
-                if isinstance(entry, list) or isinstance(entry, tuple):
+                if isinstance(entry, (list, tuple)):
                     entry = ", \n".join(entry)
                 else:
                     entry = str(entry)
@@ -240,44 +411,70 @@ class Report(object):
         return "\n".join(table)
      
         
-    def htmlReport(self, path):
+    def htmlReport(self, path, processes = 1, threads = 1, 
+                   cachePath = None):
         """Stores an html report. 'path' is the complete path and file name 
         of the main page. All intermediate directories will be created, 
-        if non existent.
+        if non existent. The plots are rendered in the current process,
+        unless 'processes' (worker processes) or 'threads' are greater than
+        1 (see renderPlots()). If the report object was created with 
+        'embed_images', no image files are written. If 'cachePath' is 
+        given, the evaluation results are cached in this file (see 
+        Chronicles.evaluation()).
         """              
         
         if not path.lower().endswith(".html"):
             path += ".html"
-        imgDir = os.path.splitext(path)[0]
-        if not os.path.isdir(imgDir):
-            os.mkdir(imgDir)
+        imgDir = path[:-len(".html")]
+        if not self.embed_images:
+            try:
+                os.makedirs(imgDir)
+            except OSError:
+                if not os.path.isdir(imgDir): raise
+        imgPrefix = os.path.join(imgDir, "")
         
         info = self.chronicles.info()
-        results = self.chronicles.evaluation()
+        results = self.chronicles.evaluation(cachePath)
                
         page = ReportPage()
+        plots = []
+        embedded = [] # positions of the embedded images on the page
         
-        if TITLE in info.keys(): page.addTop('<h1>'+info[TITLE]+'</h1>')
+        def addPlot(method, data, fileName):
+            """Adds the plot to the list of plots to be rendered and the
+            image to the current section of the page."""
+            if self.embed_images:
+                plots.append((method, (data, None)))
+                embedded.append(page.placeholder())
+            else:
+                imgPath = imgPrefix + fileName
+                if self._needsRendering(imgPath):
+                    plots.append((method, (data, imgPath)))
+                page.add('<p><img src="'+imgPath+'"></p>\n')
+        
+        if TITLE in info: page.addTop('<h1>'+info[TITLE]+'</h1>')
         page.addTop(self.infoParagraph(DATE, info))
         page.addTop(self.infoParagraph(EXPERIMENTERS, info))
         page.addTop(self.infoParagraph(DESCRIPTION, info))
         page.addTop('<hr />\n')
         page.addTop(self.infoTable(KEYS, info))
            
+        def series(*keys):
+            """Returns the part of the results that a plot needs (only this
+            is passed to the worker processes)."""
+            return dict((key, results[key]) for key in keys)
+           
         page.section("Institution Choice and Contributions")
-        imgPath = os.path.join(imgDir, "choice_contrib.png")
-        self.plot_choice_contrib(results, imgPath)
-        page.add('<p><img src="'+imgPath+'"></p>\n')
+        addPlot("plot_choice_contrib", series(SI_MEMBERS, SFI_MEMBERS, 
+                AV_CONTRIB_SI, AV_CONTRIB_SFI), "choice_contrib.png")
             
         page.section("Behavioral Patterns and Payoff")
-        imgPath = os.path.join(imgDir, "behavior_payoff.png")
-        self.plot_behavior_payoff(results, imgPath)
-        page.add('<p><img src="'+imgPath+'"></p>\n')
+        addPlot("plot_behavior_payoff", series(FREE_RIDERS, HIGH_CONTRIBUTORS,
+                PAYOFF_HC, PAYOFF_FR), "behavior_payoff.png")
             
         page.section("Impact of Punishment on Payoff")
-        imgPath = os.path.join(imgDir, "impact_punishment.png")
-        self.plot_payoff_punishment(results, imgPath)         
-        page.add('<p><img src="'+imgPath+'"></p>\n')             
+        addPlot("plot_payoff_punishment", series(PUNISH_HC, NO_PUNISH_HC, 
+                PAYOFF_NOP_HC, PAYOFF_P_HC), "impact_punishment.png")
         
 #        page.section("Agent Class Statistics")
 #        for className, stats in results[AGENT_CLASS_STATS].items():
@@ -292,36 +489,36 @@ class Report(object):
 #            page.add('<p><img src="'+imgPath+'"></p>\n')            
             
         page.section("Detailed Agent Statistics")
-        items = list(results[AGENT_STATS].items())
-        items.sort()
         lastName = ""
-        for name, stats in items:
-            currentName = name[name.find(".")+1:]
+        for name, stats in sorted(results[AGENT_STATS].items()):
+            # of each run of agents of the same class only the first one
+            # is reported
+            currentName = name.partition(".")[2] or name
             if currentName == lastName:
                 continue
-            else:
-                lastName = currentName
+            lastName = currentName
             page.subsection(name + " Statistics")
             
-            imgPath = os.path.join(imgDir, name.strip()+"_payoff.png")
-            self.plot_agent_payoff(stats, imgPath)
-            page.add('<p><img src="'+imgPath+'"></p>\n')
-            
-            imgPath = os.path.join(imgDir, name.strip()+"_contrib.png")
-            self.plot_agent_contrib(stats, imgPath)
-            page.add('<p><img src="'+imgPath+'"></p>\n') 
+            addPlot("plot_agent_payoff", stats, name.strip() + "_payoff.png")
+            addPlot("plot_agent_contrib", stats, name.strip() + "_contrib.png")
         
+        images = self.renderPlots(plots, processes, threads)
+        for position, png in zip(embedded, images):
+            page.fill(position, '<p><img src="data:image/png;base64,%s"></p>\n' 
+                      % base64.b64encode(png).decode("ascii"))
         page.writeToDisk(path)
 
 
 
 def selftest():
-    with open("../test/Test.json", "r") as f:
-        s = f.read()
+    import webbrowser
+    with open("../test/Test.json", "rb") as f:
+        s = f.read() # the JSON parser decodes the bytes itself
         chronicles = Chronicles("Report.selftest()", "Eckhart Arnold", 
-                                "Self-test of the Report.py module with artificially generated data.")
+                                "Self-test of the Report.py module with "
+                                "artificially generated data.")
         chronicles.fromJSON(s)
-        report = Report(chronicles)
+        report = Report(chronicles, source = "../test/Test.json")
         report.htmlReport("../test/report.html")
         webbrowser.open("../test/report.html")
             
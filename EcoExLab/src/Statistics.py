@@ -20,12 +20,22 @@ Created on 08.04.2011
     along with this program.  If not, see <http://www.gnu.org/licenses/>
 """
 
-from Agent import SI, SFI, ALL
+import os, operator, itertools, hashlib, json
+from Agent import SI, SFI, ALL, infoRecords, recordInfos
+from Game import njit
 try:
     import numpy
     NaN = numpy.NaN
 except ImportError:
     NaN = float('nan')
+try:
+    import numba
+except ImportError:
+    numba = None
+try:
+    from bottleneck import nanmean, nanstd
+except ImportError:
+    from numpy import nanmean, nanstd
 
 
 ###############################################################################
@@ -34,22 +44,28 @@ except ImportError:
 #
 ###############################################################################
 
+# lists longer than this are handed over to numpy by median(); for shorter
+# lists the conversion to an array costs more than sorting the list
+NUMPY_THRESHOLD = 256
+
 def mean(values):
-    """Returns the mean value of a list of values or zero if the list is 
-    empty."""
+    """Returns the mean value of a list (or array) of values or zero if the 
+    list is empty."""
     n = len(values)
     if n == 0: return 0.0
-    return sum(values) / float(len(values))
+    if isinstance(values, numpy.ndarray):
+        return float(values.mean())
+    return sum(values) / float(n)
 
 def median(values):
-    """Returns the median value of a list of values of zero if the list is
-    empty. 
-    ATTENTION: the order of the elements of the list will be
-    changed by the function.
+    """Returns the median value of a list (or array) of values of zero if the 
+    list is empty. (The list itself is not changed.)
     """
     n = len(values)
     if n == 0: return 0.0
-    values.sort()
+    if isinstance(values, numpy.ndarray) or n > NUMPY_THRESHOLD:
+        return float(numpy.median(values))
+    values = sorted(values)
     if n % 2 == 0:
         return (values[n//2-1] + values[n//2]) / 2.0
     else:
@@ -85,16 +101,31 @@ def extremeAgents(infoList, valueList, cmpFunc):
         return []        
 
     
+def _pickAgents(infoList, mask):
+    """Returns the list of those agent infos for which 'mask' is True.
+    'infoList' can also be an object array (see RoundStatistics.infoArray()).
+    """
+    if isinstance(infoList, numpy.ndarray):
+        return infoList[mask].tolist()
+    return [infoList[i] for i in numpy.flatnonzero(mask)]
+
+    
 def maxAgents(infoList, valueList):
     """Returns a list containing the agent info(s) with the highest value in the
     value list."""
-    return extremeAgents(infoList, valueList, lambda a,b: (a > b) - (a < b))
+    assert len(infoList) == len(valueList)
+    if len(valueList) == 0: return []
+    values = numpy.asarray(valueList)
+    return _pickAgents(infoList, values == values.max())
 
 
 def minAgents(infoList, valueList):
     """Returns a list containing the agent info(s) with the lowest value in the
     value list."""
-    return extremeAgents(infoList, valueList, lambda a,b: (a < b) - (a > b))
+    assert len(infoList) == len(valueList)
+    if len(valueList) == 0: return []
+    values = numpy.asarray(valueList)
+    return _pickAgents(infoList, values == values.min())
 
 
         
@@ -105,23 +136,16 @@ def nearestAgents(infoList, valueList, pivotValue):
     the lowest value above the pivot value (in this order).
     """
     assert len(infoList) == len(valueList)
-    l = len(valueList)
-    if l > 0:
-        pa = pivotValue
-        pb = pivotValue        
-        if pivotValue not in valueList:
-            for v in valueList:
-                if v < pivotValue:
-                    if v > pa or pa == pivotValue:
-                        pa = v
-                elif v > pivotValue:
-                    if v < pb or pb == pivotValue:
-                        pb = v
-        head = [infoList[i] for i in range(l) if valueList[i] == pa]
-        tail = [infoList[i] for i in range(l) if valueList[i] == pb]
-        return head + tail            
-    else:
-        return []
+    if len(valueList) == 0: return []
+    values = numpy.asarray(valueList)
+    matches = values == pivotValue
+    if matches.any():
+        return _pickAgents(infoList, matches)
+    below = values[values < pivotValue]
+    above = values[values > pivotValue]
+    head = _pickAgents(infoList, values == below.max()) if len(below) else []
+    tail = _pickAgents(infoList, values == above.min()) if len(above) else []
+    return head + tail
 
     
 def closestAgents(infoList, valueList, pivotValue):
@@ -130,20 +154,9 @@ def closestAgents(infoList, valueList, pivotValue):
     the pivot value, only agents with the pivot value will be returned.
     """
     assert len(infoList) == len(valueList)
-    l = len(valueList)
-    if l > 0:
-        minDelta = abs(pivotValue - valueList[0])
-        result = [infoList[0]]
-        for i in range(l):
-            delta = abs(pivotValue - valueList[i])
-            if delta < minDelta:
-                result = [infoList[i]]
-                minDelta = delta
-            elif delta == minDelta:
-                result.append(infoList[i])
-        return result
-    else:
-        return[]
+    if len(valueList) == 0: return []
+    deltas = numpy.abs(pivotValue - numpy.asarray(valueList))
+    return _pickAgents(infoList, deltas == deltas.min())
             
             
 def meanAgents(infoList, valueList):
@@ -168,24 +181,59 @@ def medianAgents(infoList, valueList):
 #
 ###############################################################################
 
+_getters = {}
+
+def _getter(variable):
+    """Returns the (cached) function that reads 'variable' from an AgentInfo
+    object. A 'variable' ending with "()" is a method that is called."""
+    getter = _getters.get(variable)
+    if getter is None:
+        if variable[-2:] == "()":
+            getter = operator.methodcaller(variable[:-2])
+        else:
+            getter = operator.attrgetter(variable)
+        _getters[variable] = getter
+    return getter
+
+
 class RoundStatistics(object):
     """A class that gathers agent data for one round of the game
     and provides toolbox methods to evaluate lists of AgentInfo objects.
     
     Variables:
         roundNr    - int: the round for which the statistics were gathered
-        infoLists  - dictionary string (agent allegiance keys) -> tuples of
+        infoLists  - dictionary int (agent allegiance keys) -> tuples of
                      AgentInfo objects: contains agent info lists for 1)
                      all agents, 2) agents in the sanctioning institution (SI)
                      and 3) agents in the sanction free institution
+        masks      - dictionary int (agent allegiance keys) -> boolean arrays
+                     that mark the agents of the respective info list in 
+                     the list of all agents
+        cache      - dictionary of the results of value() and agents()
+    
+    The info lists are kept as tuples, because agents may iterate over 
+    them, test them for membership or truth value. For selecting agents 
+    with boolean masks infoArray() returns the same lists as numpy object
+    arrays.
     """
+
+    __slots__ = ("roundNr", "masks", "infoLists", "cache", "_valueCache",
+                 "_infoArrays", "_arrayCache", "_bucketCache")
     
     def __init__(self, agentInfoList, roundNr):
         self.roundNr = roundNr
+        allegiances = numpy.array([ag.allegiance for ag in agentInfoList],
+                                  dtype=int)
+        self.masks = {ALL: numpy.ones(len(agentInfoList), dtype=bool),
+                      SI: allegiances == SI, SFI: allegiances == SFI}
         self.infoLists = {ALL: agentInfoList, 
-                SI: tuple(ag for ag in agentInfoList if ag.allegiance == SI),
-                SFI: tuple(ag for ag in agentInfoList if ag.allegiance == SFI)}
+                SI: tuple(itertools.compress(agentInfoList, self.masks[SI])),
+                SFI: tuple(itertools.compress(agentInfoList, self.masks[SFI]))}
         self.cache = {}
+        self._valueCache = {}
+        self._infoArrays = {}
+        self._arrayCache = {}
+        self._bucketCache = {}
 
     def agentInfos(self, allegiance):
         """Returns a list of agent infos of either all agents or
@@ -193,15 +241,67 @@ class RoundStatistics(object):
         """
         return self.infoLists[allegiance]
 
+    def infoArray(self, allegiance):
+        """Returns the (cached) info list of the agents with 'allegiance' as
+        numpy object array, so that agents can be picked with boolean 
+        masks, e.g. s.infoArray(ALL)[s.masks[SI]]. The agent picking 
+        functions above accept these arrays as info lists.
+        """
+        infos = self._infoArrays.get(allegiance)
+        if infos is None:
+            # filling an empty array keeps numpy from looking into the infos
+            infos = numpy.empty(len(self.infoLists[allegiance]), dtype=object)
+            infos[:] = self.infoLists[allegiance]
+            self._infoArrays[allegiance] = infos
+        return infos
+
+    def _values(self, allegiance, variable):
+        """Returns the (cached) tuple of the values of 'variable' of the 
+        agents with 'allegiance'. A 'variable' ending with "()" is a method
+        of the AgentInfo objects that is called."""
+        key = (allegiance, variable)
+        values = self._valueCache.get(key)
+        if values is None:
+            values = tuple(map(_getter(variable), self.infoLists[allegiance]))
+            self._valueCache[key] = values
+        return values
+
     def valueList(self, allegiance, variable):
         """Returns the list of values of the agents with 'allegiance'
-        have in a particular 'variable'."""
-        if variable[-2:] == "()":
-            return [agInfo.__getattribute__(variable)() \
-                    for agInfo in self.infoLists[allegiance]]
-        else:
-            return [agInfo.__getattribute__(variable) \
-                    for agInfo in self.infoLists[allegiance]]
+        have in a particular 'variable'. (The list is a fresh copy that
+        may be changed by the caller.)"""
+        return list(self._values(allegiance, variable))
+    
+    def valueArray(self, allegiance, variable):
+        """Returns the values of the agents with 'allegiance' in a 
+        particular 'variable' as (cached) numpy array. The array is read 
+        only, because it is shared by all callers."""
+        key = (allegiance, variable)
+        values = self._arrayCache.get(key)
+        if values is None:
+            values = numpy.array(self._values(allegiance, variable))
+            values.setflags(write=False)
+            self._arrayCache[key] = values
+        return values
+        
+    def bucketMasks(self, allegiance, variable, limits):
+        """Returns a tuple of len(limits) + 1 boolean masks over the list of
+        all agents. Mask k marks the agents with 'allegiance' for which 
+        the value of 'variable' lies in bucket k, i.e. limits[k-1] <= value
+        < limits[k] (the first bucket has no lower and the last bucket no
+        upper bound). The 'limits' must be ascending. The masks are cached 
+        and read only, because they are shared by all callers."""
+        limits = tuple(limits)
+        key = (allegiance, variable, limits)
+        masks = self._bucketCache.get(key)
+        if masks is None:
+            bucketNrs = numpy.digitize(self.valueArray(ALL, variable), limits)
+            bucketNrs[~self.masks[allegiance]] = -1
+            masks = tuple(bucketNrs == k for k in range(len(limits) + 1))
+            for mask in masks:
+                mask.setflags(write=False)
+            self._bucketCache[key] = masks
+        return masks
         
     def value(self, func, allegiance, variable):
         """Applies the statistical function 'func' to a particular 'variable' 
@@ -209,14 +309,16 @@ class RoundStatistics(object):
         Caches and returns the result! Example: s._calculate(mean, SI, PROFIT)
         returns the mean profit of the agents in the sanctioning institution.
         """
-        key = str(func) + allegiance + variable
-        if key in self.cache:
-            return self.cache[key]
-        else:
-            values = self.valueList(allegiance, variable)
-            result = func(values)
+        key = (func, allegiance, variable)
+        result = self.cache.get(key)
+        if result is None:
+            if (func is mean or func is median) and \
+                    len(self.infoLists[allegiance]) > NUMPY_THRESHOLD:
+                result = func(self.valueArray(allegiance, variable))
+            else:
+                result = func(self.valueList(allegiance, variable))
             self.cache[key] = result
-            return result
+        return result
         
     def agents(self, func, allegiance, variable):
         """Returns a tuple of AgentInfo objects that the function 'func' picks
@@ -224,14 +326,13 @@ class RoundStatistics(object):
         of a prticular 'variable'. 
         'func' must have the form: func(info list, value list) -> info list.
         """
-        key = str(func) + allegiance + variable
-        if key in self.cache:
-            return self.cache[key]
-        else:
-            values = self.valueList(allegiance, variable)
-            result = tuple(func(self.infoLists[allegiance], values))
+        key = (func, allegiance, variable)
+        result = self.cache.get(key)
+        if result is None:
+            result = tuple(func(self.infoLists[allegiance], 
+                                self.valueList(allegiance, variable)))
             self.cache[key] = result
-            return result
+        return result
                      
     
 ###############################################################################
@@ -263,6 +364,13 @@ class AgentStatistics(object):
                         AgentStatistics object
                         
     """
+
+    __slots__ = ("name", "statistics")
+    
+    _getter = operator.attrgetter("allegiance", "overallResult", 
+                                  "contribution", "sanctioning", 
+                                  "punishments", "commendations")
+    
     def __init__(self, infoSeries, name):
         """Initializes AgentStatistics object with the series of agent info
         objects, one for each round. 'name' is (any) name or number
@@ -271,19 +379,20 @@ class AgentStatistics(object):
 
         self.name = name
         
+        # one pass over the series; the columns are copied into separate
+        # (contiguous) arrays
+        values = numpy.array([AgentStatistics._getter(info) 
+                              for info in infoSeries], dtype=float).T.copy()
+        allegiance, payoff, contrib, sanct, punish, commend = values
+        world = infoSeries[0].world
         s = {}
-        s[AG_SI] = [1.0 if info.allegiance == "SI" else 0.0 \
-                    for info in infoSeries]
-        s[AG_SFI] = [1.0 - si for si in s[AG_SI]]
-        s[AG_PAYOFF] = [float(info.overallResult) for info in infoSeries]        
-        s[AG_CONTRIB] = [float(info.contribution) / info.world.contribTokens\
-                         for info in infoSeries]
-        s[AG_SANCT] = [float(info.sanctioning) / info.world.sanctionTokens\
-                         for info in infoSeries]
-        s[AG_PUNISH] = [float(info.punishments) for info in infoSeries]
-        s[AG_COMMEND] = [float(info.commendations) for info in infoSeries]
-        for k,v in s.items():
-            s[k] = numpy.array(v)        
+        s[AG_SI] = (allegiance == SI).astype(float)
+        s[AG_SFI] = 1.0 - s[AG_SI]
+        s[AG_PAYOFF] = payoff
+        s[AG_CONTRIB] = contrib / world.contribTokens
+        s[AG_SANCT] = sanct / world.sanctionTokens
+        s[AG_PUNISH] = punish
+        s[AG_COMMEND] = commend
         self.statistics = s
     
 
@@ -308,16 +417,21 @@ class AgentClassStatistics(object):
                       group statistics where compiled.
     """
 
+    __slots__ = ("name", "statsList", "statistics")
+
     def __init__(self, agentStatisticsList, name):
         """Initializes the object with a list of agent statistics object
         with the agent statistics' list and an arbitrary class name."""
         self.name = name
         self.statsList = agentStatisticsList
-        self.statistics = { MEAN: {}, DEVIATION: {}}
-        for k in AGSTAT_KEYS:
-            a = [s.statistics[k] for s in self.statsList]
-            self.statistics[MEAN][k] = numpy.mean(a, axis=0)
-            self.statistics[DEVIATION][k] = numpy.std(a, axis=0)
+        # array (agents x keys x rounds) of all time series of all agents;
+        # NaN values are left out of the mean and the deviation
+        series = numpy.array([[s.statistics[k] for k in AGSTAT_KEYS] 
+                              for s in self.statsList])
+        means = nanmean(series, axis=0)
+        deviations = nanstd(series, axis=0)
+        self.statistics = { MEAN: dict(zip(AGSTAT_KEYS, means)), 
+                            DEVIATION: dict(zip(AGSTAT_KEYS, deviations))}
         
         
 ###############################################################################
@@ -349,11 +463,95 @@ EXPSTAT_KEYS = (SI_MEMBERS, SFI_MEMBERS, AV_CONTRIB_SI, AV_CONTRIB_SFI,
                 NO_PUNISH_HC, PAYOFF_NOP_HC, PAYOFF_P_HC,
                 AGENT_STATS, AGENT_CLASS_STATS)
 
+###############################################################################
+#
+# per round totals for the experiment statistics
+#
+###############################################################################
+
+# columns of the 'counts' and 'sums' arrays returned by _roundTotals()
+_NUM_SI, _NUM_HC, _NUM_FR, _NUM_P_HC, _NUM_NOP_HC = range(5)
+_CONTRIB_SI, _CONTRIB_SFI, _PAYOFF_HC, _PAYOFF_FR, _PAYOFF_P_HC, \
+        _PAYOFF_NOP_HC = range(6)
+
+@njit(cache=True)
+def _roundTotals(isSI, contribs, sanctioning, payoffs, hcLimit, frLimit):
+    """Returns the arrays (rounds x 5) 'counts' and (rounds x 6) 'sums' of
+    the numbers of SI members, high contributors, free riders, punishing 
+    and not punishing high contributors and of the sums of the contributions
+    in the SI and the SFI and of the payoffs of these groups. All arguments
+    except the limits for high contributors and free riders are arrays 
+    (rounds x agents)."""
+    rounds, agents = isSI.shape
+    counts = numpy.zeros((rounds, 5), dtype=numpy.int64)
+    sums = numpy.zeros((rounds, 6))
+    for r in range(rounds):
+        for i in range(agents):
+            c = contribs[r, i]
+            if isSI[r, i]:
+                counts[r, _NUM_SI] += 1
+                sums[r, _CONTRIB_SI] += c
+                if c >= hcLimit:
+                    counts[r, _NUM_HC] += 1
+                    sums[r, _PAYOFF_HC] += payoffs[r, i]
+                    if sanctioning[r, i] > 0:
+                        counts[r, _NUM_P_HC] += 1
+                        sums[r, _PAYOFF_P_HC] += payoffs[r, i]
+                    else:
+                        counts[r, _NUM_NOP_HC] += 1
+                        sums[r, _PAYOFF_NOP_HC] += payoffs[r, i]
+            else:
+                sums[r, _CONTRIB_SFI] += c
+                if c <= frLimit:
+                    counts[r, _NUM_FR] += 1
+                    sums[r, _PAYOFF_FR] += payoffs[r, i]
+    return counts, sums
+
+def _maskedTotals(isSI, contribs, sanctioning, payoffs, hcLimit, frLimit):
+    """Array version of _roundTotals() for the case that numba is not
+    available. The values are added agent by agent, i.e. in the same order
+    as by _roundTotals(), so that both yield exactly the same sums (numpy's
+    sum() would add them pairwise)."""
+    HCMasks = isSI & (contribs >= hcLimit)
+    FRMasks = ~isSI & (contribs <= frLimit)
+    PMasks = HCMasks & (sanctioning > 0)
+    NPMasks = HCMasks & (sanctioning <= 0)
+    counts = numpy.stack([m.sum(axis=1) for m in 
+                          (isSI, HCMasks, FRMasks, PMasks, NPMasks)], axis=1)
+    # (rounds x agents x 6) array of the summed values
+    terms = numpy.stack([numpy.where(m, v, 0.0) for m, v in 
+                         ((isSI, contribs), (~isSI, contribs), 
+                          (HCMasks, payoffs), (FRMasks, payoffs),
+                          (PMasks, payoffs), (NPMasks, payoffs))], axis=2)
+    sums = numpy.zeros((isSI.shape[0], 6))
+    for i in range(isSI.shape[1]):
+        sums += terms[:, i]
+    return counts, sums
+
+if numba == None:
+    _roundTotals = _maskedTotals
+
+
 class ExperimentStatistics(object):
     """Computes data over all rounds of the simulation/experiment.
     
+    The data of each round is stored column-wise, i.e. as a record array 
+    (see Agent.RECORD_DTYPE) of the agents' variables plus the arrays of the
+    sanctions given by each agent.
+    
     Variables (protected):
-        statList    - list of RoundStatistics objects, one for each round
+        records     - list of record arrays, one for each round
+        sanctPositive - list of (agents x agents) arrays of the positive
+                      sanctions, one for each round
+        sanctNegative - list of (agents x agents) arrays of the negative
+                      sanctions, one for each round
+        sanctioning - list of arrays of the tokens spent for sanctioning by
+                      each agent, one for each round
+        statList    - list of RoundStatistics objects, one for each round. 
+                      (The RoundStatistics objects are created on demand by
+                      roundStats().)
+        world       - WorldInfo object to which the AgentInfo objects of the
+                      round statistics are connected
         statistics  - dictionary with various statistical data for the whole 
                       experiment or simulation. See constant EXPSTAT_KEYS for the
                       entries of this dictionary.
@@ -370,9 +568,20 @@ class ExperimentStatistics(object):
         agClassStats - AgentStatistic for groups of Agents. The list
                        will be created when calling the evaluation() method
     """
+
+    __slots__ = ("records", "sanctPositive", "sanctNegative", "sanctioning",
+                 "statList", "world", "statistics", "contribTokens", 
+                 "sanctionTokens", "agentNames", "agentClasses", "numAgents",
+                 "agStats", "agClassStats", "_evaluated")
     
-    def __init__(self, contribTokens, sanctionTokens, agentNames, agentClasses):
+    def __init__(self, contribTokens, sanctionTokens, agentNames, agentClasses,
+                 world = None):
+        self.records = []
+        self.sanctPositive = []
+        self.sanctNegative = []
+        self.sanctioning = []
         self.statList = []
+        self.world = world
         self.statistics = {}
         self.contribTokens = contribTokens
         self.sanctionTokens = sanctionTokens
@@ -381,17 +590,38 @@ class ExperimentStatistics(object):
         self.numAgents = -1
         self.agStats = []
         self.agClassStats = {}
+        self._evaluated = False
     
     def add(self, infoList, roundNr):
-        assert roundNr == len(self.statList), "wrong round number"
-        assert self.statistics == {}, "evaluation already done"
-        assert self.numAgents < 0 or self.numAgents == len(infoList), \
+        """Adds the list of AgentInfo objects of round 'roundNr'."""
+        records, positive, negative = infoRecords(infoList)
+        self.addRecords(records, positive, negative, roundNr)
+        self.statList[roundNr] = RoundStatistics(infoList, roundNr)
+        
+    def addRecords(self, records, sanctPositive, sanctNegative, roundNr):
+        """Adds the data of round 'roundNr', i.e. the record array of the
+        agent variables and the (agents x agents) arrays of the positive
+        and negative sanctions."""
+        assert roundNr == len(self.records), "wrong round number"
+        assert not self._evaluated, "evaluation already done"
+        assert self.numAgents < 0 or self.numAgents == len(records), \
                 "different number of agents"                    
-        self.numAgents = len(infoList)          
-        self.statList.append(RoundStatistics(infoList, roundNr))
+        self.numAgents = len(records)
+        self.records.append(records)
+        self.sanctPositive.append(sanctPositive)
+        self.sanctNegative.append(sanctNegative)
+        self.sanctioning.append(sanctPositive.sum(axis=1) \
+                                + sanctNegative.sum(axis=1))
+        self.statList.append(None)
     
     def roundStats(self, roundNr):
         """Returns the RoundStatistics object for a specific round."""
+        if self.statList[roundNr] == None:
+            assert self.world, "world needed for creating round statistics"
+            infos = recordInfos(self.records[roundNr], 
+                                self.sanctPositive[roundNr],
+                                self.sanctNegative[roundNr], self.world)
+            self.statList[roundNr] = RoundStatistics(infos, roundNr)
         return self.statList[roundNr]
     
     def agentStats(self, agentNr):
@@ -411,19 +641,24 @@ class ExperimentStatistics(object):
         (agent statistics, agent class statistics)."""
         assert len(self.statList) > 0
         
-        agentLists = [[info] for info in self.statList[0].agentInfos(ALL)]
-        for st in self.statList[1:]:
-            infos = st.agentInfos(ALL)
-            for i in range(len(agentLists)):
-                agentLists[i].append(infos[i])
+        statList = [self.roundStats(r) for r in range(len(self.statList))]
+        # transposition: rounds x agents -> agents x rounds
+        agentLists = list(zip(*[st.agentInfos(ALL) for st in statList]))
         self.agStats = [AgentStatistics(agList, name) \
                         for agList, name in zip(agentLists, self.agentNames)]
         
-        self.agClassStats = dict([(ac, []) for ac in self.agentClasses])
-        for agClass, agStat in zip(self.agentClasses, self.agStats):
-            self.agClassStats[agClass].append(agStat)
-        for k, v in self.agClassStats.items():
-            self.agClassStats[k] = AgentClassStatistics(v, k)
+        # group the agents by class: sorting the agents by the class number
+        # (stably, i.e. keeping the order of the agents within a class)
+        # yields the members of each class as one slice
+        classes, classNrs = numpy.unique(self.agentClasses, 
+                                         return_inverse=True)
+        order = numpy.argsort(classNrs, kind="mergesort")
+        bounds = numpy.cumsum(numpy.bincount(classNrs))[:-1]
+        self.agClassStats = {}
+        for agClass, members in zip(classes.tolist(), 
+                                    numpy.split(order, bounds)):
+            self.agClassStats[agClass] = AgentClassStatistics(
+                    [self.agStats[i] for i in members], agClass)
         
         agsDict = dict([(n, s.statistics) \
                         for n, s in zip(self.agentNames, self.agStats)])
@@ -431,79 +666,130 @@ class ExperimentStatistics(object):
                         for c in self.agentClasses])      
         return (agsDict, agcDict)             
     
-    def evaluation(self):
+    def _dataKey(self):
+        """Returns a string that identifies the evaluated data: the number
+        of agents and rounds, the tokens and a digest of the recorded 
+        rounds."""
+        digest = hashlib.md5()
+        for a in itertools.chain(self.records, self.sanctPositive, 
+                                 self.sanctNegative):
+            digest.update(numpy.ascontiguousarray(a).tobytes())
+        return "%i %i %i %i %s" % (self.numAgents, len(self.records), 
+                                   self.contribTokens, self.sanctionTokens,
+                                   digest.hexdigest())
+    
+    def _saveEvaluation(self, cachePath):
+        """Writes the evaluation results to the numpy archive 'cachePath'.
+        The nested dictionaries are flattened; the list of the key paths is
+        stored along with the arrays."""
+        arrays = {}
+        paths = []
+        def flatten(d, keys):
+            for k, v in d.items():
+                if isinstance(v, dict):
+                    flatten(v, keys + [k])
+                else:
+                    arrays["arr_%i" % len(paths)] = numpy.asarray(v)
+                    paths.append(keys + [k, isinstance(v, list)])
+        flatten(self.statistics, [])
+        arrays["dataKey"] = numpy.array(self._dataKey())
+        arrays["paths"] = numpy.array(json.dumps(paths))
+        with open(cachePath, "wb") as f:
+            numpy.savez_compressed(f, **arrays)
+    
+    def _loadEvaluation(self, cachePath):
+        """Reads the evaluation results from the numpy archive 'cachePath'
+        into 'statistics'. Returns False, if there is no such file or if it
+        has been written for different data."""
+        if not os.path.exists(cachePath):
+            return False
+        try:
+            archive = numpy.load(cachePath)
+            try:
+                if str(archive["dataKey"]) != self._dataKey():
+                    return False
+                statistics = {}
+                for i, path in enumerate(json.loads(str(archive["paths"]))):
+                    d = statistics
+                    for k in path[:-2]:
+                        d = d.setdefault(k, {})
+                    a = archive["arr_%i" % i]
+                    d[path[-2]] = a.tolist() if path[-1] else a
+            finally:
+                archive.close()
+        except (IOError, OSError, ValueError, KeyError):
+            return False
+        self.statistics = statistics
+        return True
+    
+    def evaluation(self, cachePath = None):
         """Calculates the global statistical data for the experiment 
         and returns it as dictionary with the entries listed in EXPSTAT_KEYS.
+        
+        If 'cachePath' is given, the results are read from this file, if 
+        it has been written for the same data before, or else they are 
+        stored there after calculating them. (In the former case 'agStats'
+        and 'agClassStats' remain empty.)
         """
-        assert len(self.statList) > 0, "Nothing to evaluate yet"
-
-        def highContributors(agList):
-            return [ag for ag in agList \
-                    if ag.contribution >= 3*self.contribTokens/4]
-        def freeRiders(agList):
-            return [ag for ag in agList \
-                    if ag.contribution <= 1*self.contribTokens/4]        
-        def nonPunishers(agList):
-            return [ag for ag in agList if ag.allegiance == SI and \
-                    ag.sanctioning == 0]
-        def punishers(agList):
-            return [ag for ag in agList if ag.allegiance == SI and \
-                    ag.sanctioning > 0] 
-
-        if self.statistics != {}:
+        assert len(self.records) > 0, "Nothing to evaluate yet"
+
+        if self._evaluated:
             return self.statistics
+        if cachePath != None and self._loadEvaluation(cachePath):
+            self._evaluated = True
+            return self.statistics
+        
+        def ratios(counts, totals):
+            """Returns the list of counts / totals for each round (NaN, if 
+            the total is zero)."""
+            with numpy.errstate(divide="ignore", invalid="ignore"):
+                r = counts / numpy.asarray(totals, dtype=float)
+            r[totals == 0] = NaN
+            return r.tolist()
         
-        maxContrib = float(self.contribTokens)        
-        HCLists = [highContributors(s.agentInfos(SI)) for s in self.statList]
-        FRLists = [freeRiders(s.agentInfos(SFI)) for s in self.statList]
-        PLists = [punishers(l) for l in HCLists]
-        NPLists = [nonPunishers(l) for l in HCLists]        
+        # all rounds at once: arrays (rounds x agents)
+        records = numpy.array(self.records)
+        sanctioning = numpy.array(self.sanctioning)
+        payoffs = records["profit"] + records["receivedSanct"] \
+                + self.sanctionTokens - sanctioning
+        counts, sums = _roundTotals(records["allegiance"] == SI, 
+                                    records["contribution"], sanctioning,
+                                    payoffs, 3*self.contribTokens/4,
+                                    1*self.contribTokens/4)
+        numSI = counts[:, _NUM_SI]
         
-        si_members = [len(s.agentInfos(SI)) / float(self.numAgents) \
-                      for s in self.statList]
-        self.statistics[SI_MEMBERS] = si_members
-        self.statistics[SFI_MEMBERS] = [1.0 - si_members[i] \
-                                        for i in range(len(si_members))]
+        si_members = numSI / float(self.numAgents)
+        self.statistics[SI_MEMBERS] = si_members.tolist()
+        self.statistics[SFI_MEMBERS] = (1.0 - si_members).tolist()
         
-        self.statistics[AV_CONTRIB_SI] = \
-                [sum([ag.contribution for ag in s.agentInfos(SI)]) / \
-                 (maxContrib * len(s.agentInfos(SI))) \
-                 if len(s.agentInfos(SI)) > 0 else NaN for s in self.statList]
-        self.statistics[AV_CONTRIB_SFI] = \
-                [sum([ag.contribution for ag in s.agentInfos(SFI)]) / \
-                 (maxContrib * len(s.agentInfos(SFI))) \
-                 if len(s.agentInfos(SFI))> 0 else NaN for s in self.statList]
+        maxContrib = float(self.contribTokens)
+        self.statistics[AV_CONTRIB_SI] = ratios(sums[:, _CONTRIB_SI], 
+                                                maxContrib * numSI)
+        self.statistics[AV_CONTRIB_SFI] = ratios(sums[:, _CONTRIB_SFI], 
+                maxContrib * (self.numAgents - numSI))
                 
         self.statistics[HIGH_CONTRIBUTORS] = \
-                [len(hc) / float(self.numAgents) for hc in HCLists]
+                (counts[:, _NUM_HC] / float(self.numAgents)).tolist()
         self.statistics[FREE_RIDERS] = \
-                [len(fr) / float(self.numAgents) for fr in FRLists]
-        self.statistics[PAYOFF_HC] = \
-                [sum(ag.overallResult for ag in hc) / float(len(hc)) \
-                 if len(hc) > 0 else NaN for hc in HCLists]
-        self.statistics[PAYOFF_FR] = \
-                [sum(ag.overallResult for ag in fr) / float(len(fr)) \
-                 if len(fr) > 0 else NaN for fr in FRLists]        
+                (counts[:, _NUM_FR] / float(self.numAgents)).tolist()
+        self.statistics[PAYOFF_HC] = ratios(sums[:, _PAYOFF_HC], 
+                                            counts[:, _NUM_HC])
+        self.statistics[PAYOFF_FR] = ratios(sums[:, _PAYOFF_FR], 
+                                            counts[:, _NUM_FR])
                 
-        self.statistics[NO_PUNISH_HC] = \
-                [len(nonPunishers(highContributors(s.agentInfos(SI)))) / \
-                 float(len(s.agentInfos(SI))) \
-                 if len(s.agentInfos(SI)) > 0 else NaN for s in self.statList]
-        self.statistics[PUNISH_HC] = \
-                [len(punishers(highContributors(s.agentInfos(SI)))) / \
-                 float(len(s.agentInfos(SI))) \
-                 if len(s.agentInfos(SI)) > 0 else NaN for s in self.statList]
+        self.statistics[NO_PUNISH_HC] = ratios(counts[:, _NUM_NOP_HC], numSI)
+        self.statistics[PUNISH_HC] = ratios(counts[:, _NUM_P_HC], numSI)
                 
-        self.statistics[PAYOFF_NOP_HC] = \
-                [sum([ag.overallResult for ag in np]) / float(len(np)) \
-                 if len(np) > 0 else NaN for np in NPLists]
-        self.statistics[PAYOFF_P_HC] = \
-                [sum([ag.overallResult for ag in p]) / float(len(p)) \
-                 if len(p) > 0 else NaN for p in PLists]
+        self.statistics[PAYOFF_NOP_HC] = ratios(sums[:, _PAYOFF_NOP_HC], 
+                                                counts[:, _NUM_NOP_HC])
+        self.statistics[PAYOFF_P_HC] = ratios(sums[:, _PAYOFF_P_HC], 
+                                              counts[:, _NUM_P_HC])
                 
         agStatsDict, agClassStatsDict = self._agentEvaluation()
         self.statistics[AGENT_STATS] = agStatsDict
         self.statistics[AGENT_CLASS_STATS] = agClassStatsDict
 
+        self._evaluated = True
+        if cachePath != None:
+            self._saveEvaluation(cachePath)
         return self.statistics
-
@@ -20,9 +20,10 @@ Created on 07.04.2011
 
 import sys
 from random import randint, random
+import numpy
 import webbrowser
 
-from Agent import AgentBase, AgentInfo, SI, SFI
+from Agent import AgentBase, AgentInfo, SI, SFI, emptySanctions
 from Game import PublicGoodsGame
 from World import World
 from Statistics import median, mean
@@ -48,7 +49,7 @@ class ModerateEgoistContribution(AgentBase):
             return randint(0, tokens/2)
                
         stats = self.world.statistics
-        if self.history[-1].allegiance != self.allegiance:
+        if self.lastInfo.allegiance != self.allegiance:
             # just changed the allegiance: if in Rome do as the Romans do
             return stats.value(mean, self.allegiance, "contribution")
         
@@ -82,7 +83,7 @@ class SimpleHeuristicsContribution(AgentBase):
         if self.world.roundNr == 0:
             return randint(tokens/2, tokens)        
         
-        if self.history[-1].allegiance != self.allegiance:
+        if self.lastInfo.allegiance != self.allegiance:
             return self.world.statistics.value(mean, self.allegiance, "contribution")        
         
         if self.allegiance == SI:
@@ -107,50 +108,54 @@ class SimpleHeuristicsContribution(AgentBase):
 
 class NoSanctions(AgentInfo):
     def sanction(self, tokens, agentList):
-        return ({}, {})    
-
-
-def selectForSanction(dictionary, tokens, infos, otherIndices, selector, 
-                      strength):
-    """Adds the nr from agents from 'agentList' to the dictionary with a
-    sanction value of 'strength' (or less if not enough tokens are available)
-    if 'selector' returns True for the agent. Returns the number of 
-    tokens left.""" 
-    baddies = set([i for i in otherIndices if infos[i].allegiance == SI \
-                   and selector(infos[i].contribution)])
-    if len(baddies) > 0:
-        punishment = max(1, min(strength, tokens / len(baddies)))
-        for i in otherIndices:
-            if i in baddies and i not in dictionary and tokens >= punishment:
-                dictionary[i] = punishment
-                tokens -= punishment
+        return emptySanctions(self.world.numAgents)
+
+
+def selectForSanction(sanctions, tokens, otherIndices, candidates, strength):
+    """Sanctions the agents from the array 'otherIndices' in the sanctions 
+    array with a sanction value of 'strength' (or less if not enough tokens
+    are available) if they are marked in the boolean mask 'candidates'. 
+    Returns the number of tokens left.""" 
+    baddies = candidates[otherIndices]
+    count = int(baddies.sum())
+    if count > 0:
+        punishment = max(1, min(strength, tokens / count))
+        # in the order of 'otherIndices' every not yet sanctioned baddie 
+        # gets the punishment until the tokens are used up
+        chosen = otherIndices[baddies & (sanctions[otherIndices] == 0)]
+        # tokens left before each punishment (subtracted one by one, because
+        # the punishment may be a fraction of a token)
+        left = numpy.subtract.accumulate(
+                    numpy.append(tokens, numpy.full(len(chosen), punishment)))
+        n = int((left[:-1] >= punishment).sum())
+        sanctions[chosen[:n]] = punishment
+        tokens = float(left[n])
     return tokens
 
 class StepwiseSanctions(AgentBase):
     def sanction(self, tokens, otherAgentIndices):
         initialTokens = tokens
-        positive = {}
-        negative = {}
-        q1 = self.world.contribTokens / 4
-        q2 = self.world.contribTokens * 2 / 4
-        q3 = self.world.contribTokens *3 / 4 
-        q4 = self.world.contribTokens
-        infos = self.world.anonymizedInfos
-        tokens = selectForSanction(negative, tokens, infos, otherAgentIndices,    
-                                   lambda c: c < q1, 2)
-        tokens = selectForSanction(negative, tokens, infos, otherAgentIndices,
-                                   lambda c: c >= q1 and c < q2, 1)
+        positive, negative = emptySanctions(self.world.numAgents)
+        others = numpy.asarray(otherAgentIndices, dtype=int)
+        # the SI members by their contribution in the last round: below one
+        # quarter of the contribution tokens, below one half, below three 
+        # quarters, below all tokens and all tokens (the anonymized infos 
+        # are the info list of all agents of the round statistics, 
+        # therefore the masks are indexed by the anonymized indices)
+        q = self.world.contribTokens
+        low, lowMedium, highMedium, high, full = \
+                self.world.statistics.bucketMasks(SI, "contribution", 
+                                                  (q / 4, q * 2 / 4, 
+                                                   q * 3 / 4, q))
+        tokens = selectForSanction(negative, tokens, others, low, 2)
+        tokens = selectForSanction(negative, tokens, others, lowMedium, 1)
         
         tokens = tokens/3 # commendations are considered less important
         if tokens < initialTokens/3:
-            tokens = selectForSanction(positive, tokens, infos, 
-                                       otherAgentIndices, lambda c: c == q4, 2)
-            tokens = selectForSanction(positive, tokens, infos, 
-                                       otherAgentIndices, 
-                                       lambda c: c >= q3 and c < q4, 1)
+            tokens = selectForSanction(positive, tokens, others, full, 2)
+            tokens = selectForSanction(positive, tokens, others, high, 1)
             
-        tokens = selectForSanction(negative, tokens, infos, otherAgentIndices,                       
-                                   lambda c: c >= q2 and c < q3, 1)        
+        tokens = selectForSanction(negative, tokens, others, highMedium, 1)
         
         return (positive, negative)
 
@@ -221,7 +226,7 @@ def Simulation(fileName):
     world.run()
     #report = Report(chronicles)
     with open(fileName, "w") as f:
-        f.write(chronicles.toJSON())
+        chronicles.writeJSON(f)
 
 def readChroniclesTest(fileName):
     with open(fileName, "r") as f:
@@ -20,8 +20,13 @@ Created on 01.04.2011
 """
 
 import random
+import numpy
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    ThreadPoolExecutor = None
 
-from Agent import PublicInfo, SI, SFI
+from Agent import publicInfos, AgentStates, SI, SFI
 from Statistics import RoundStatistics
 from Institution import SanctioningInstitution, SanctionFreeInstitution
 
@@ -37,6 +42,9 @@ class WorldInfo(object):
         maxRounds      - int: maximal number of rounds
         numAgents      - int: total number of agents/persons 
                               in the simulation/experiment
+        states         - AgentStates object: the scalar variables of all
+                         agents, indexed by the position of the agent in 
+                         the world's agent list
         contribTokens  - int: maximum number of tokens that can be contributed
                          every round
         sanctionTokens - int: maximum number of tokens that can be used for
@@ -55,6 +63,7 @@ class WorldInfo(object):
         self.roundNr = 0
         self.maxRounds = 0  # are agents supposed to know this?
         self.numAgents = 0
+        self.states = AgentStates(0)
         self.contribTokens = 0
         self.sanctionTokens = 0
         self.anonymizedInfos = tuple()
@@ -84,8 +93,10 @@ class World(WorldInfo):
                               the 'agents' list, but in randomly sorted order.
                               The order of the 'anonymized' list is re-shuffled
                               before every new round of the game
-        __anonymizedIndices   - dictionary agent->int: a dictionary that tells
-                              the index of an agent in the 'anonymized' list
+        anonymizedMap       - numpy array of ints: the index in the 
+                              'anonymized' list of each agent in the 'agents'
+                              list. (Updated together with the 'anonymized' 
+                              list.)
         SI                  - SanctioningInstitution object: the sanctioning
                               institution
         SFI                 - SanctionFreeInstitution object: the sanctioning 
@@ -93,6 +104,13 @@ class World(WorldInfo):
         chronicles          - ChroniclesInterface object: writing of the
                               simulation history and evaluating of the 
                               simulation data
+        threads             - int: number of threads on which the agents'
+                              methods are called (see setup())
+        executor            - ThreadPoolExecutor object or None: thread pool
+                              on which the agents' chooseInstitution(),
+                              contribute() and sanction() methods are 
+                              called. It is started by the first round and
+                              shut down by close().
     """
 
     def __init__(self, chronicles):
@@ -101,13 +119,25 @@ class World(WorldInfo):
         self.roundNr = -1
         self.agents = []
         self.anonymized = [] # randomly ordered list of agents
-        self.__anonymizedIndices = {}    
+        self.anonymizedMap = numpy.zeros(0, dtype=int)
         self.SI = SanctioningInstitution()
         self.SFI = SanctionFreeInstitution()
         self.chronicles = chronicles
+        self.threads = 1
+        self.executor = None
 
-    def setup(self, agents, game, maxRounds, contribTokens, sanctionTokens):
-        """Sets the simulation up."""
+    def setup(self, agents, game, maxRounds, contribTokens, sanctionTokens,
+              threads = 1):
+        """Sets the simulation up. If 'threads' is greater than 1, the agents'
+        chooseInstitution(), contribute() and sanction() methods are called
+        concurrently on a pool of 'threads' threads. This only pays off if 
+        these methods release the GIL (e.g. by calling numpy or external 
+        code) and it requires that they do not change any shared state. 
+        (Agents that draw random numbers from a shared generator will 
+        produce results that depend on the scheduling of the threads.)
+        The thread pool is started by the first round. run() shuts it
+        down when finished; a world that is driven by calling nextRound()
+        must be closed with close() (or be used as a context manager)."""
         assert self.roundNr < 0, "Simulation has already started!"
         assert maxRounds >= 1
         assert contribTokens >= 1
@@ -117,16 +147,24 @@ class World(WorldInfo):
         self.game = game
         self.agents = agents
         self.anonymized = agents[:] # shallow copy of agents
-        for agent in self.agents:           
+        self.numAgents = len(self.agents)
+        self.anonymizedMap = numpy.arange(self.numAgents)
+        self.game.bind(self.numAgents)
+        self.states = AgentStates(self.numAgents)
+        for i, agent in enumerate(self.agents):
+            agent.attachStates(self.states, i)
             agent.connect(self)
         self.SI.connect(self)
         self.SFI.connect(self)        
             
-        self.numAgents = len(self.agents)
         self.maxRounds = maxRounds
         self.roundNr = -1
         self.contribTokens = contribTokens
         self.sanctionTokens = sanctionTokens
+        if threads > 1:
+            assert ThreadPoolExecutor != None, \
+                    "concurrent.futures is needed for running agents in threads"
+        self.threads = threads
         
         self.chronicles.setupComplete(self)
         
@@ -137,20 +175,40 @@ class World(WorldInfo):
                 + "already finished or was never set up properly!"
         
         self.roundNr = 0
-        while self.roundNr < self.maxRounds:
-            self.nextRound()
+        try:
+            while self.roundNr < self.maxRounds:
+                self.nextRound()
+        finally:
+            self.close()
 
+    def close(self):
+        """Shuts the thread pool of the agents down (see setup())."""
+        if self.executor != None:
+            self.executor.shutdown()
+            self.executor = None
+            
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+        return False
         
     def nextRound(self):
         """Runs one complete round of the simulation and increses the 
         round counter  A full round includes all three stages: institution
         choice, voluntary contribution and stanctioning."""
         assert self.roundNr < self.maxRounds
+        if self.threads > 1 and self.executor == None:
+            self.executor = ThreadPoolExecutor(self.threads)
         
-        random.shuffle(self.anonymized)
-        for i, agent in enumerate(self.anonymized):
-            self.__anonymizedIndices[agent] = i
-        self.anonymizedInfos = tuple(PublicInfo(agent) for agent in self.anonymized)            
+        # shuffling the positions instead of the agents yields the same
+        # permutation and allows to invert it with one array operation
+        order = list(range(self.numAgents))
+        random.shuffle(order)
+        self.anonymized = [self.agents[i] for i in order]
+        self.anonymizedMap[order] = numpy.arange(self.numAgents)
+        self.anonymizedInfos = publicInfos(self, order)
         self.statistics = RoundStatistics(self.anonymizedInfos, self.roundNr-1)
             
         self.institutionChoiceStage()
@@ -172,8 +230,14 @@ class World(WorldInfo):
         into the respective lists."""
         self.SI.members = []
         self.SFI.members = []
-        for agent in self.agents:
-            institution = agent.chooseInstitution()
+        # the choices only depend on the last round's data, therefore 
+        # they can be collected first (and concurrently, see setup())
+        if self.executor != None:
+            choices = list(self.executor.map(
+                    lambda agent: agent.chooseInstitution(), self.agents))
+        else:
+            choices = [agent.chooseInstitution() for agent in self.agents]
+        for agent, institution in zip(self.agents, choices):
             if institution == SI:
                 self.SI.members.append(agent)
                 agent.allegiance = SI
@@ -203,5 +267,5 @@ class World(WorldInfo):
         """Returns the index of the 'agent' in the anonymized list for 
         this round.
         """
-        return self.__anonymizedIndices[agent]
+        return int(self.anonymizedMap[agent.worldIndex])
 
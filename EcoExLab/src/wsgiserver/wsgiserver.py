@@ -5,10 +5,20 @@ requests to a wsgi application.
 """
 
 
-import os, fnmatch
+import os, re, fnmatch
 from wsgiref import simple_server
 
 
+def compileWildcards(wildcards):
+    """Returns a regular expression that matches a (normcased) path if 
+    any of the 'wildcards' matches it in the sense of fnmatch.fnmatch().
+    An empty list of wildcards yields an expression that never matches."""
+    if not wildcards:
+        return re.compile("(?!)")
+    patterns = [fnmatch.translate(os.path.normcase(w)) for w in wildcards]
+    return re.compile("|".join("(?:%s)" % p for p in patterns))
+
+
 def readDirTree(directory = '.', include = ['*'], exclude = []):
     """Returns all files of the current directory and all subdirectories
     as a list. Only files that match any of the wildcards or names
@@ -16,20 +26,15 @@ def readDirTree(directory = '.', include = ['*'], exclude = []):
     exclude list will be included. The returned list contains the
     complete file paths relative to 'directory'."""
     files = []
+    included = compileWildcards(include).match
+    excluded = compileWildcards(exclude).match
     directory = os.path.normpath(directory); N = len(directory)
     for dirname, subdirs, names in os.walk(directory):
         dirname = dirname[N:]
         for entry in names:
             absolute_path = os.path.join(dirname, entry)
-            for wildcard in include:
-                if fnmatch.fnmatch(absolute_path, wildcard):
-                    break
-            else:
-                continue
-            for wildcard in exclude:
-                if fnmatch.fnmatch(absolute_path, wildcard):
-                    break
-            else:         
+            normalized = os.path.normcase(absolute_path)
+            if included(normalized) and not excluded(normalized):
                 files.append(absolute_path)
     return files
 
@@ -44,15 +49,41 @@ class AppProxy(object):
     ERROR_403 = "<html><body><h1>403 - Forbidden: %s</h1></body></html>"
     
     def __init__(self, application, directory = '.',
-                 include = ['*'], exclude = ['*.py', '*~', '.*', '/.*']):
+                 include = ['*'], exclude = ['*.py', '*~', '.*', '/.*'],
+                 cache = False, maxCachedSize = 65536):
         """Crates AppProxy object. All files in 'directory' that match a wild
         card in 'include' and do not match any wild card in exclude will
         be served upon request. All queries or non GET requests (e.g. POST
         requests) will be delegated to 'application'. Files added after
-        the AppProxy object was created will always be ignored."""
+        the AppProxy object was created will always be ignored. 
+        
+        The files are read upon every request. If 'cache' is True, the 
+        contents of the files of at most 'maxCachedSize' bytes are instead
+        read only once when the AppProxy object is created. Changes to 
+        these files are then not served until a new AppProxy object is
+        created. (Files that cannot be read at this time are read upon 
+        request, so that the error is reported to the client.)"""
         self.directory = directory
-        self.allowedFiles = set(readDirTree(directory, include, exclude))
+        # the files are stored as url paths, i.e. with forward slashes
+        # and without leading slash
+        self.allowedFiles = frozenset(path.replace(os.sep, '/').lstrip('/')
+                for path in readDirTree(directory, include, exclude))
         self.application = application
+        self.pages = {}
+        if cache:
+            for path in self.allowedFiles:
+                fullPath = os.path.join(directory, *path.split('/'))
+                try:
+                    if os.path.getsize(fullPath) <= maxCachedSize:
+                        self.pages[path] = self.read_file(path)
+                except (IOError, OSError):
+                    pass # left to be read (and reported) upon request
+                    
+    def read_file(self, path):
+        """Returns the content of the file with the url path 'path' 
+        (relative to the directory) as bytes."""
+        with open(os.path.join(self.directory, *path.split('/')), 'rb') as f:
+            return f.read()
         
     def error_message(self, start_response, status_code, msg):
         headers = [('Content-Type', 'text/html; charset=utf-8'),
@@ -69,13 +100,12 @@ class AppProxy(object):
             
             else: 
                 # no query, therefore serve the requested web page
-                path = environ['PATH_INFO']
-                if path.startswith("/"): path = path[1:]
+                path = environ['PATH_INFO'].lstrip('/')
                 if path in self.allowedFiles:
                     try:
-                        f = open(os.path.join(self.directory, path))
-                        # page = bytes(f.read(), "utf-8") # <-- works only with python 3
-                        page = f.read().encode("utf-8")
+                        page = self.pages.get(path)
+                        if page is None:
+                            page = self.read_file(path)
                         headers = [('Content-Type','text/html; charset=utf-8'), 
                                    ('Content-Length', str(len(page)))]
                         start_response('200 OK', headers)
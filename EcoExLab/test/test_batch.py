@@ -0,0 +1,70 @@
+"""test_batch - Tests for running simulation replicas with Batch.
+
+@author: eckhartarnold
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>
+"""
+
+import os
+import sys
+import unittest
+
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "src"))
+
+import Test
+from Game import PublicGoodsGame
+from Batch import runReplicas
+
+
+def setup(nr):
+    """Returns the World.setup() arguments for replica 'nr' (defined at
+    module level, so that it can be passed to the worker processes)."""
+    agents = [Test.Random() for i in range(2)] + \
+             [Test.EgoistPunisher() for i in range(4)] + \
+             [Test.SimpleHeuristicsPunisher() for i in range(4)]
+    return (agents, PublicGoodsGame(1.6), 8, 20, 20)
+
+
+class TestRunReplicas(unittest.TestCase):
+
+    def assertSameChronicles(self, chroniclesList, otherList):
+        self.assertEqual(len(chroniclesList), len(otherList))
+        for chronicles, other in zip(chroniclesList, otherList):
+            for name in chronicles.data.dtype.names:
+                self.assertTrue(numpy.array_equal(chronicles.data[name],
+                                                  other.data[name]), name)
+            self.assertTrue(numpy.array_equal(chronicles.sanctPositive,
+                                              other.sanctPositive))
+            self.assertTrue(numpy.array_equal(chronicles.sanctNegative,
+                                              other.sanctNegative))
+
+    def testSeededRunsAreReproducible(self):
+        first = runReplicas(setup, 2, processes=1, seed=17)
+        second = runReplicas(setup, 2, processes=1, seed=17)
+        self.assertSameChronicles(first, second)
+        # the replicas are seeded differently
+        self.assertFalse(numpy.array_equal(first[0].data["contribution"],
+                                           first[1].data["contribution"]))
+
+    def testProcessesDoNotChangeTheResults(self):
+        serial = runReplicas(setup, 2, processes=1, seed=17)
+        parallel = runReplicas(setup, 2, processes=2, seed=17)
+        self.assertSameChronicles(serial, parallel)
+
+
+if __name__ == "__main__":
+    unittest.main()
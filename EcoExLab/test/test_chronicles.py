@@ -0,0 +1,102 @@
+"""test_chronicles - Tests for loading and evaluating result files.
+
+@author: eckhartarnold
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>
+"""
+
+import json
+import os
+import sys
+import unittest
+
+import numpy
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TEST_DIR, "..", "src"))
+
+from Chronicles import Chronicles
+
+
+TEST_JSON = os.path.join(TEST_DIR, "Test.json")
+
+# evaluation of Test.json as computed by the original (dictionary based)
+# implementation; rounds 26 and 27 contain fractional sanctions
+AGENT = "  13.EgoistPunisher"
+BASELINE_SANCTIONING = [0.4, 0.4666666666666666, 0.4125, 0.4]
+BASELINE_COMMENDATIONS = [18.0, 9.777777777777777, 13.166666666666666, 16.0]
+BASELINE_PAYOFF = [54.038059781676516, 43.935345837175234,
+                   49.677250779459406, 52.098049660150195]
+BASELINE_HIGH_CONTRIBUTORS_PAYOFF = [49.075742596080666, 42.714900646373664,
+                                     37.56113904638402, 46.01561065248991]
+
+
+def loadChronicles(s):
+    chronicles = Chronicles()
+    chronicles.fromJSON(s)
+    return chronicles
+
+
+class TestLoadTestJSON(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        with open(TEST_JSON, "r") as f:
+            cls.source = f.read()
+        cls.chronicles = loadChronicles(cls.source)
+
+    def testFractionalValuesAreKept(self):
+        results = json.loads(self.source)["Results"]
+        variables = json.loads(self.source)["Setup"]["Basic Variables"]
+        for name in ("commendations", "punishments", "receivedSanct"):
+            k = variables.index(name)
+            stored = [[values[k] for values in rd] for rd in results]
+            self.assertTrue(numpy.array_equal(self.chronicles.data[name],
+                                              stored), name)
+        k = variables.index("sanctPositive")
+        for r, rd in enumerate(results):
+            for i, values in enumerate(rd):
+                for agentNr, tokens in values[k].items():
+                    self.assertEqual(
+                        self.chronicles.sanctPositive[r, i, int(agentNr)],
+                        tokens)
+        self.assertFalse(numpy.array_equal(self.chronicles.sanctPositive,
+                            numpy.round(self.chronicles.sanctPositive)))
+
+    def testEvaluationMatchesBaseline(self):
+        ev = self.chronicles.evaluation()
+        agent = ev["Detailed Agent statistics"][AGENT]
+        for values, expected in (
+                (agent["Agent's amount of sanctioning"], BASELINE_SANCTIONING),
+                (agent["Commendations received by agent"],
+                 BASELINE_COMMENDATIONS),
+                (agent["Agent's payoff"], BASELINE_PAYOFF),
+                (ev["Average payoff of high contributors in SI"],
+                 BASELINE_HIGH_CONTRIBUTORS_PAYOFF)):
+            self.assertTrue(numpy.allclose(values[25:29], expected,
+                                           rtol=1e-12, atol=0))
+
+    def testRoundTrip(self):
+        chronicles = loadChronicles(self.chronicles.toJSON())
+        for name in self.chronicles.data.dtype.names:
+            self.assertTrue(numpy.array_equal(chronicles.data[name],
+                                              self.chronicles.data[name]))
+        self.assertTrue(numpy.array_equal(chronicles.sanctPositive,
+                                          self.chronicles.sanctPositive))
+        self.assertTrue(numpy.array_equal(chronicles.sanctNegative,
+                                          self.chronicles.sanctNegative))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+"""test_game - Tests for the public goods games.
+
+@author: eckhartarnold
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>
+"""
+
+import os
+import sys
+import unittest
+
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "src"))
+
+from Game import PublicGoodsGame
+
+
+class RatioDependentGame(PublicGoodsGame):
+    """The gain factor rises with the average contribution ratio."""
+    def _mcpr(self, r, n):
+        return (self.gain + r) / n
+
+
+class TestPerCapitaReturn(unittest.TestCase):
+
+    def testPublicGoodsGame(self):
+        game = PublicGoodsGame(1.6)
+        contributions = numpy.array([10.0, 5.0, 0.0, 20.0])
+        for numAgents in (None, 2, 4, 10):
+            if numAgents != None:
+                game.bind(numAgents)
+            self.assertAlmostEqual(game.perCapitaReturn(contributions, 20),
+                                   1.6 / 4 * 35)
+
+    def testOverriddenMcpr(self):
+        game = RatioDependentGame(1.6)
+        game.bind(10)
+        contributions = numpy.array([10.0, 5.0, 0.0, 20.0])
+        self.assertAlmostEqual(game.perCapitaReturn(contributions, 20),
+                               (1.6 + 35 / 80.0) / 4 * 35)
+
+
+class TestSelftest(unittest.TestCase):
+
+    @unittest.skipUnless(__debug__, "assertions are disabled")
+    def testMcprBounds(self):
+        for gain in (1.6, 2, 50):
+            PublicGoodsGame(gain)._selftest()
+        self.assertRaises(AssertionError, PublicGoodsGame(1000.5)._selftest)
+
+
+if __name__ == "__main__":
+    unittest.main()
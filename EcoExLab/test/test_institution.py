@@ -0,0 +1,144 @@
+"""test_institution - Regression tests for the accounting of the
+sanctioning stage.
+
+@author: eckhartarnold
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>
+"""
+
+import os
+import sys
+import unittest
+
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "src"))
+
+import Institution
+import Test
+from Agent import AgentBase, SI, emptySanctions, SANCTION_DTYPE
+from Batch import runReplicas
+from Game import PublicGoodsGame
+from World import World
+from Chronicles import Chronicles
+
+
+class Contributor(AgentBase):
+    """Always joins the SI, contributes half of the tokens and does not
+    sanction anybody."""
+    def chooseInstitution(self):
+        return SI
+
+    def contribute(self, tokens):
+        return tokens / 2
+
+    def sanction(self, tokens, otherAgentIndices):
+        return emptySanctions(self.world.numAgents)
+
+
+class Punisher(Contributor):
+    """Punishes every other member with one token."""
+    def sanction(self, tokens, otherAgentIndices):
+        positive, negative = emptySanctions(self.world.numAgents)
+        negative[otherAgentIndices] = 1
+        return (positive, negative)
+
+
+def simulation(rounds):
+    """Runs a simulation of one punisher and two contributors with 10
+    contribution and 4 sanctioning tokens and returns the chronicles."""
+    chronicles = Chronicles()
+    world = World(chronicles)
+    agents = [Punisher(), Contributor(), Contributor()]
+    world.setup(agents, PublicGoodsGame(1.6), rounds, 10, 4)
+    world.run()
+    return chronicles
+
+
+def setup(nr):
+    """Returns the World.setup() arguments of a simulation with fractional
+    sanctions."""
+    agents = [Test.Random() for i in range(2)] + \
+             [Test.EgoistPunisher() for i in range(10)] + \
+             [Test.SimpleHeuristicsPunisher() for i in range(10)]
+    return (agents, PublicGoodsGame(1.6), 30, 20, 20)
+
+
+class TestSanctioningAccounts(unittest.TestCase):
+
+    def testAccounts(self):
+        # profit per round: 1.6 * 15 / 3 + 10 - 5 = 13; round 0 is
+        # sanction free. Afterwards the sanctioning institution credits the
+        # 4 sanctioning tokens twice and charges the tokens spent in the
+        # previous round (this is the accounting of the original 
+        # implementation): the punisher spends two tokens per round and 
+        # each contributor is punished with 3 tokens
+        chronicles = simulation(4)
+        accounts = chronicles.data["account"]
+        self.assertTrue(numpy.allclose(accounts, [[17, 17, 17],
+                                               [38, 35, 35],
+                                               [57, 53, 53],
+                                               [76, 71, 71]]))
+
+    def testAccountsFollowTheRoundResults(self):
+        chronicles = simulation(4)
+        data = chronicles.data
+        sanctioning = (chronicles.sanctPositive.sum(axis=2) +
+                       chronicles.sanctNegative.sum(axis=2))
+        results = data["profit"][1:] + 2 * 4 - sanctioning[:-1] + \
+                  data["receivedSanct"][1:]
+        self.assertTrue(numpy.allclose(numpy.diff(data["account"], axis=0),
+                                       results))
+        self.assertTrue(numpy.allclose(data["receivedSanct"][1:],
+                                       [[0, -3, -3]] * 3))
+
+
+class TestArrayVersion(unittest.TestCase):
+    """The array version of _applySanctions() (used if numba is not 
+    available) must yield exactly the same results."""
+
+    def testSums(self):
+        rng = numpy.random.RandomState(3)
+        tokens = rng.randint(0, 5, (30, 40)) / 3.0
+        tokens[tokens < 0.5] = 0
+        tokens = tokens.astype(SANCTION_DTYPE)
+        values = numpy.unique(tokens)
+        impacts = rng.uniform(-3, 3, values.shape)
+        results = []
+        for function in (Institution._applySanctions, 
+                         Institution._accumulateSanctions):
+            rng.seed(5)
+            counts = rng.uniform(0, 1, 40)
+            received = rng.uniform(0, 1, 40)
+            function(tokens, values, impacts, counts, received)
+            results.append((counts, received))
+        self.assertTrue(numpy.array_equal(results[0][0], results[1][0]))
+        self.assertTrue(numpy.array_equal(results[0][1], results[1][1]))
+
+    def testSimulation(self):
+        kernel = runReplicas(setup, 1, processes=1, seed=11)[0]
+        applySanctions = Institution._applySanctions
+        Institution._applySanctions = Institution._accumulateSanctions
+        try:
+            fallback = runReplicas(setup, 1, processes=1, seed=11)[0]
+        finally:
+            Institution._applySanctions = applySanctions
+        for name in kernel.data.dtype.names:
+            self.assertTrue(numpy.array_equal(kernel.data[name],
+                                              fallback.data[name]), name)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,152 @@
+"""test_statistics - Tests for the round statistics, the array version of 
+the round totals and the cache of the evaluation results.
+
+@author: eckhartarnold
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>
+"""
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TEST_DIR, "..", "src"))
+
+import Statistics
+from Agent import SI, SFI
+from Chronicles import Chronicles
+from Statistics import RoundStatistics
+
+
+def loadChronicles(s):
+    chronicles = Chronicles()
+    chronicles.fromJSON(s)
+    return chronicles
+
+
+class Info(object):
+    def __init__(self, allegiance, contribution):
+        self.allegiance = allegiance
+        self.contribution = contribution
+
+
+class StatisticsTestCase(unittest.TestCase):
+
+    def assertSameStatistics(self, statistics, other):
+        self.assertEqual(sorted(statistics.keys()), sorted(other.keys()))
+        for key, value in statistics.items():
+            if isinstance(value, dict):
+                self.assertSameStatistics(value, other[key])
+            else:
+                self.assertEqual(type(value), type(other[key]), key)
+                self.assertTrue(numpy.array_equal(value, other[key],
+                                                  equal_nan=True), key)
+
+
+class TestBucketMasks(unittest.TestCase):
+
+    def testBuckets(self):
+        infos = (Info(SI, 0), Info(SFI, 5), Info(SI, 5), Info(SI, 10),
+                 Info(SI, 20), Info(SFI, 20))
+        stats = RoundStatistics(infos, 0)
+        masks = stats.bucketMasks(SI, "contribution", (5, 10, 20))
+        self.assertEqual([m.tolist() for m in masks],
+                         [[True, False, False, False, False, False],
+                          [False, False, True, False, False, False],
+                          [False, False, False, True, False, False],
+                          [False, False, False, False, True, False]])
+        self.assertIs(stats.bucketMasks(SI, "contribution", [5, 10, 20]),
+                      masks)
+        self.assertFalse(masks[0].flags.writeable)
+        self.assertEqual(stats.cache, {})
+
+
+class TestArrayVersion(StatisticsTestCase):
+    """The array version of _roundTotals() (used if numba is not available)
+    must yield exactly the same results."""
+
+    def testTotals(self):
+        rng = numpy.random.RandomState(7)
+        shape = (30, 40)
+        isSI = rng.uniform(size=shape) < 0.6
+        contribs = rng.randint(0, 21, shape).astype(float)
+        sanctioning = rng.randint(0, 3, shape) / 3.0
+        payoffs = rng.uniform(0, 60, shape)
+        args = (isSI, contribs, sanctioning, payoffs, 15.0, 5.0)
+        counts, sums = Statistics._roundTotals(*args)
+        maskedCounts, maskedSums = Statistics._maskedTotals(*args)
+        self.assertTrue(numpy.array_equal(counts, maskedCounts))
+        self.assertTrue(numpy.array_equal(sums, maskedSums))
+
+    def testEvaluation(self):
+        with open(os.path.join(TEST_DIR, "Test.json"), "r") as f:
+            source = f.read()
+        statistics = loadChronicles(source).evaluation()
+        roundTotals = Statistics._roundTotals
+        Statistics._roundTotals = Statistics._maskedTotals
+        try:
+            masked = loadChronicles(source).evaluation()
+        finally:
+            Statistics._roundTotals = roundTotals
+        self.assertSameStatistics(masked, statistics)
+
+
+class TestEvaluationCache(StatisticsTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        with open(os.path.join(TEST_DIR, "Test.json"), "r") as f:
+            cls.source = f.read()
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.cachePath = os.path.join(self.tmpDir, "evaluation.npz")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def testRoundTrip(self):
+        chronicles = loadChronicles(self.source)
+        statistics = chronicles.evaluation(self.cachePath)
+        self.assertTrue(os.path.exists(self.cachePath))
+        cached = loadChronicles(self.source)
+        self.assertSameStatistics(cached.evaluation(self.cachePath),
+                                  statistics)
+        # loaded from the cache, i.e. without an agent evaluation
+        self.assertEqual(cached.statistics.agStats, [])
+
+    def testStaleCacheIsRejected(self):
+        loadChronicles(self.source).evaluation(self.cachePath)
+        d = json.loads(self.source)
+        d["Results"][3][0][3] += 1  # contribution of the first agent
+        changed = loadChronicles(json.dumps(d))
+        statistics = changed.evaluation(self.cachePath)
+        self.assertNotEqual(changed.statistics.agStats, [])
+        self.assertSameStatistics(statistics,
+                                  loadChronicles(json.dumps(d)).evaluation())
+        # the cache has been rewritten for the changed data
+        cached = loadChronicles(json.dumps(d))
+        self.assertSameStatistics(cached.evaluation(self.cachePath),
+                                  statistics)
+        self.assertEqual(cached.statistics.agStats, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
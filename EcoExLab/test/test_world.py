@@ -0,0 +1,63 @@
+"""test_world - Tests for the thread pool of the world.
+
+@author: eckhartarnold
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "src"))
+
+import Test
+from Chronicles import Chronicles
+from Game import PublicGoodsGame
+from World import World
+
+
+def setupWorld(threads):
+    world = World(Chronicles())
+    agents = [Test.Random() for i in range(2)] + \
+             [Test.EgoistPunisher() for i in range(4)]
+    world.setup(agents, PublicGoodsGame(1.6), 3, 20, 20, threads)
+    return world
+
+
+class TestThreadPool(unittest.TestCase):
+
+    def testSetupDoesNotStartThreads(self):
+        world = setupWorld(2)
+        self.assertEqual(world.executor, None)
+        world.close()
+
+    def testRunShutsThePoolDown(self):
+        world = setupWorld(2)
+        world.run()
+        self.assertEqual(world.executor, None)
+
+    def testContextManagerShutsThePoolDown(self):
+        with setupWorld(2) as world:
+            world.roundNr = 0
+            world.nextRound()
+            executor = world.executor
+            self.assertNotEqual(executor, None)
+        self.assertEqual(world.executor, None)
+        self.assertRaises(RuntimeError, executor.submit, len, ())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,131 @@
+"""test_wsgiserver - Tests for the file matching and the page cache of the
+proxy web server.
+
+@author: eckhartarnold
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "src", "wsgiserver"))
+
+from wsgiserver import compileWildcards, readDirTree, AppProxy
+
+
+def application(environ, start_response):
+    """Stands in for the proxied application."""
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return [b'application']
+
+
+class TestWildcards(unittest.TestCase):
+
+    def testMatching(self):
+        match = compileWildcards(['*.html', 'data/*.json']).match
+        for path in ('index.html', 'report/plot.html', 'data/Test.json'):
+            self.assertTrue(match(os.path.normcase(path)), path)
+        for path in ('index.htm', 'Test.json', 'index.html~'):
+            self.assertFalse(match(os.path.normcase(path)), path)
+
+    def testEmptyListMatchesNothing(self):
+        match = compileWildcards([]).match
+        self.assertFalse(match(''))
+        self.assertFalse(match('index.html'))
+
+
+class TestAppProxy(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.directory, 'report'))
+        self.files = {'index.html': b'<html>index</html>',
+                      'report/plot.png': b'\x89PNG\r\n\x1a\n\x00\xff',
+                      'server.py': b'# not served'}
+        for path, content in self.files.items():
+            self.write(path, content)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, path, content):
+        with open(os.path.join(self.directory, *path.split('/')), 'wb') as f:
+            f.write(content)
+
+    def get(self, proxy, path, query=''):
+        """Returns (status, body) of a GET request for 'path'."""
+        responses = []
+        def start_response(status, headers):
+            responses.append(status)
+        environ = {'REQUEST_METHOD': 'GET', 'QUERY_STRING': query,
+                   'PATH_INFO': path}
+        body = proxy(environ, start_response)
+        return (responses[0], body[0])
+
+    def testReadDirTree(self):
+        files = readDirTree(self.directory, ['*'], ['*.py'])
+        self.assertEqual(sorted(f.replace(os.sep, '/').lstrip('/')
+                                for f in files),
+                         ['index.html', 'report/plot.png'])
+
+    def testCachedPagesEqualTheFiles(self):
+        proxy = AppProxy(application, self.directory, cache=True)
+        self.assertEqual(sorted(proxy.pages), ['index.html',
+                                               'report/plot.png'])
+        for path in proxy.pages:
+            with open(os.path.join(self.directory, *path.split('/')),
+                      'rb') as f:
+                self.assertEqual(proxy.pages[path], f.read())
+            self.assertEqual(self.get(proxy, '/' + path),
+                             ('200 OK', self.files[path]))
+
+    def testCacheHit(self):
+        proxy = AppProxy(application, self.directory, cache=True)
+        self.write('index.html', b'<html>changed</html>')
+        self.assertEqual(self.get(proxy, '/index.html'),
+                         ('200 OK', b'<html>index</html>'))
+
+    def testCacheMiss(self):
+        proxy = AppProxy(application, self.directory)
+        self.assertEqual(proxy.pages, {})
+        self.write('index.html', b'<html>changed</html>')
+        self.assertEqual(self.get(proxy, '/index.html'),
+                         ('200 OK', b'<html>changed</html>'))
+        os.remove(os.path.join(self.directory, 'index.html'))
+        self.assertEqual(self.get(proxy, '/index.html')[0], '404 Not Found')
+
+    def testLargeFilesAreNotCached(self):
+        proxy = AppProxy(application, self.directory, cache=True,
+                         maxCachedSize=len(self.files['index.html']) - 1)
+        self.assertEqual(sorted(proxy.pages), ['report/plot.png'])
+        self.write('index.html', b'<html>changed</html>')
+        self.assertEqual(self.get(proxy, '/index.html'),
+                         ('200 OK', b'<html>changed</html>'))
+
+    def testForbiddenAndDelegatedRequests(self):
+        proxy = AppProxy(application, self.directory)
+        self.assertEqual(self.get(proxy, '/server.py')[0], '403 Forbidden')
+        self.write('new.html', b'<html>new</html>')
+        self.assertEqual(self.get(proxy, '/new.html')[0], '403 Forbidden')
+        self.assertEqual(self.get(proxy, '/index.html', 'a=1'),
+                         ('200 OK', b'application'))
+
+
+if __name__ == "__main__":
+    unittest.main()